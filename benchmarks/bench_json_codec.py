@@ -0,0 +1,109 @@
+"""
+JSON codec micro-benchmarks
+Compares the stdlib path (str round trips, as Flask and requests use by
+default) with src.services.json_codec over chat and simulator payloads.
+
+Run from the repository root:
+    python benchmarks/bench_json_codec.py [--number 200]
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services import json_codec  # noqa: E402
+
+
+def _text(words, seed):
+    rng = random.Random(seed)
+    vocab = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(2000)]
+    vocab += ['café', 'naïve', '—', '✓', '🦸‍♂️']
+    return ' '.join(rng.choice(vocab) for _ in range(words))
+
+
+def upstream_completion():
+    """OpenRouter chat completion carrying an ~8K-token reply"""
+    return {
+        'id': 'gen-1729000000-abcdef',
+        'object': 'chat.completion',
+        'created': 1729000000,
+        'model': 'google/gemini-2.0-flash-exp',
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'stop',
+            'message': {'role': 'assistant', 'content': _text(6000, 1)},
+        }],
+        'usage': {'prompt_tokens': 1800, 'completion_tokens': 8000, 'total_tokens': 9800},
+    }
+
+
+def chat_request():
+    """Incoming /api/chat body with a long conversation attached"""
+    return {
+        'message': _text(300, 2),
+        'agents': ['gpt4o'],
+        'session_id': 'testing_backend_session_1729000000_1a2b3c4d',
+        'mode': 'research',
+        'history': [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': _text(400, 100 + i)}
+            for i in range(40)
+        ],
+    }
+
+
+def simulator_session():
+    """Human simulator session as returned by /api/sessions/<id>"""
+    return {
+        'id': 'f1d2d2f9-24ab-4c4b-9c0b-1234567890ab',
+        'mode': 'human_simulator',
+        'personality': 'analytical',
+        'agents': ['gpt4o', 'gemini15'],
+        'rounds': 50,
+        'status': 'active',
+        'messages': [
+            {'role': 'assistant', 'agent': 'gpt4o' if i % 2 else 'gemini15',
+             'content': _text(500, 500 + i), 'timestamp': 1729000000.0 + i}
+            for i in range(100)
+        ],
+    }
+
+
+def bench(label, stdlib_fn, codec_fn, number):
+    stdlib = min(timeit.repeat(stdlib_fn, number=number, repeat=3)) / number
+    codec = min(timeit.repeat(codec_fn, number=number, repeat=3)) / number
+    print(f"{label:<8} stdlib {stdlib * 1e6:9.1f} us   codec {codec * 1e6:9.1f} us   x{stdlib / codec:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"orjson available: {json_codec.HAS_ORJSON}")
+    payloads = {
+        'upstream completion': upstream_completion(),
+        'chat request': chat_request(),
+        'simulator session': simulator_session(),
+    }
+    for name, payload in payloads.items():
+        # Bytes as they arrive on the wire
+        raw = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        print(f"\n{name} ({len(raw) / 1024:.0f} KiB)")
+        bench('decode',
+              lambda: json.loads(raw.decode('utf-8')),
+              lambda: json_codec.loads(raw),
+              args.number)
+        bench('encode',
+              lambda: json.dumps(payload, sort_keys=True).encode('utf-8'),
+              lambda: json_codec.dumps(payload, sort_keys=True),
+              args.number)
+
+
+if __name__ == '__main__':
+    main()
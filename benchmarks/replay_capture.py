@@ -0,0 +1,250 @@
+"""
+Deterministic traffic replay
+Re-drives a capture recorded with TRAFFIC_CAPTURE_DIR against a local
+instance. Upstream completions are served from the recording by a mock
+OpenRouter endpoint, matched on X-Request-ID and delayed by the recorded
+upstream time (optionally scaled). Streamed upstream calls are replayed as
+server-sent events spread over their recorded duration. The same server
+stands in for Stripe: recorded checkout-session calls are served in
+recorded order (Stripe requests carry no request id).
+
+Long-lived text/event-stream responses (session channel /events) are not
+replayed: they only end when the client disconnects, so their latency says
+nothing. The /send requests that drive those channels are replayed, and
+their streamed upstream calls are served from the recording.
+
+Start the backend pointed at the mock upstream, then replay:
+    OPENROUTER_BASE_URL=http://127.0.0.1:8765 OPENAI_API_BASE=http://127.0.0.1:8765 \\
+        STRIPE_API_BASE=http://127.0.0.1:8765 STRIPE_SECRET_KEY=sk_test_replay \\
+        PORT=8080 python src/main.py
+    python benchmarks/replay_capture.py captures/*.jsonl.gz --speed 1 --upstream-scale 1
+"""
+
+import argparse
+import collections
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.json_codec import dumps, loads  # noqa: E402
+from src.services.structured_logging import REQUEST_ID_HEADER  # noqa: E402
+from src.services.traffic_capture import read_capture  # noqa: E402
+
+
+class RecordedUpstream:
+    """Recorded upstream calls keyed by request id, handed out in original order per model"""
+
+    def __init__(self, envelopes, scale=1.0):
+        self.scale = scale
+        self.served = 0
+        self.missing = 0
+        self._calls = collections.defaultdict(list)
+        self._stripe_calls = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        for envelope in envelopes:
+            for call in envelope.get('upstream') or []:
+                if call['path'].startswith('/v1/'):
+                    self._stripe_calls[call['path']].append(call)
+                else:
+                    self._calls[envelope['request_id']].append(call)
+
+    def next_stripe_call(self, path):
+        with self._lock:
+            calls = self._stripe_calls.get(path)
+            if not calls:
+                self.missing += 1
+                return None
+            self.served += 1
+            return calls.popleft()
+
+    def next_call(self, request_id, model=None):
+        with self._lock:
+            calls = self._calls.get(request_id) or []
+            # Parallel calls (both agents of a channel) arrive in any order
+            index = next((i for i, call in enumerate(calls) if model is None or call.get('model') == model), None)
+            if index is None:
+                self.missing += 1
+                return None
+            self.served += 1
+            return calls.pop(index)
+
+    def pending(self, request_ids):
+        """Recorded calls not yet requested for the given request ids"""
+        with self._lock:
+            return sum(len(self._calls.get(request_id) or ()) for request_id in request_ids)
+
+
+def make_handler(upstream):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path.startswith('/v1/'):
+                call = upstream.next_stripe_call(self.path.split('?')[0])
+            else:
+                try:
+                    model = loads(raw).get('model')
+                except ValueError:
+                    model = None
+                call = upstream.next_call(self.headers.get(REQUEST_ID_HEADER), model)
+            if call is not None and call.get('stream') and call['status'] == 200:
+                self._stream(call)
+                return
+            if call is None:
+                status, body = 502, {'error': {'message': 'no recorded upstream call for this request'}}
+            else:
+                time.sleep(call['elapsed_ms'] / 1000.0 * upstream.scale)
+                status, body = call['status'], call.get('body')
+            payload = dumps(body)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, call):
+            events = call.get('events') or []
+            gap = call['elapsed_ms'] / 1000.0 * upstream.scale / (len(events) + 1)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            for event in events:
+                time.sleep(gap)
+                self.wfile.write(b'data: ' + dumps(event) + b'\n\n')
+                self.wfile.flush()
+            time.sleep(gap)
+            self.wfile.write(b'data: [DONE]\n\n')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def is_event_stream(envelope):
+    """Long-lived server-sent event responses, which end only when the client goes away"""
+    accept = (envelope.get('headers') or {}).get('Accept') or ''
+    return envelope.get('content_type') == 'text/event-stream' or 'text/event-stream' in accept
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def replay(envelopes, target, speed, workers):
+    """Send every envelope at its (scaled) original offset; returns per-request results"""
+    # requests.Session is not thread-safe; each worker keeps its own
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+    origin = envelopes[0]['ts']
+    started = time.perf_counter()
+
+    def send(envelope):
+        headers = dict(envelope.get('headers') or {})
+        headers[REQUEST_ID_HEADER] = envelope['request_id']
+        url = f"{target}{envelope['path']}"
+        if envelope.get('query'):
+            url += f"?{envelope['query']}"
+        body = envelope.get('body')
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        began = time.perf_counter()
+        try:
+            response = session.request(envelope['method'], url, headers=headers,
+                                        data=dumps(body) if body is not None else None, timeout=300, stream=True)
+            status = response.status_code
+            with response:
+                # Never wait on an event stream; keep-alives would hold it open forever
+                if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                    response.content
+        except requests.RequestException:
+            status = None
+        elapsed_ms = (time.perf_counter() - began) * 1000
+        with lock:
+            results.append((envelope, status, elapsed_ms))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for envelope in envelopes:
+            if speed > 0:
+                delay = (envelope['ts'] - origin) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, envelope)
+    return results
+
+
+def report(results):
+    by_path = collections.defaultdict(list)
+    for envelope, status, elapsed_ms in results:
+        by_path[f"{envelope['method']} {envelope['path']}"].append((envelope, status, elapsed_ms))
+
+    print(f"{'route':<40} {'n':>5} {'mismatch':>8}   {'recorded p50/p95/p99 ms':>26}   {'replayed p50/p95/p99 ms':>26}")
+    for route, rows in sorted(by_path.items()):
+        recorded = [envelope['duration_ms'] for envelope, _, _ in rows]
+        replayed = [elapsed for _, _, elapsed in rows]
+        mismatches = sum(1 for envelope, status, _ in rows if status != envelope['status'])
+        fmt = lambda values: '/'.join(f"{percentile(values, p):.0f}" for p in (50, 95, 99))
+        print(f"{route:<40} {len(rows):>5} {mismatches:>8}   {fmt(recorded):>26}   {fmt(replayed):>26}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('captures', nargs='+', help='capture-*.jsonl.gz files')
+    parser.add_argument('--target', default='http://127.0.0.1:8080', help='backend base URL')
+    parser.add_argument('--upstream-host', default='127.0.0.1')
+    parser.add_argument('--upstream-port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='arrival-rate multiplier (2 = twice as fast, 0 = back to back)')
+    parser.add_argument('--upstream-scale', type=float, default=1.0,
+                        help='multiplier on recorded upstream latency (0 = instant)')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--drain', type=float, default=30.0,
+                        help='seconds to keep serving upstream calls made after responses returned (channel streams)')
+    args = parser.parse_args()
+
+    records = sorted(
+        (envelope for path in args.captures for envelope in read_capture(path)),
+        key=lambda envelope: envelope['ts']
+    )
+    upstream = RecordedUpstream(records, scale=args.upstream_scale)
+    requests_only = [envelope for envelope in records if envelope.get('kind') != 'upstream']
+    envelopes = [envelope for envelope in requests_only if not is_event_stream(envelope)]
+    skipped = len(requests_only) - len(envelopes)
+    if not envelopes:
+        sys.exit('No replayable envelopes found in capture files')
+
+    server = ThreadingHTTPServer((args.upstream_host, args.upstream_port), make_handler(upstream))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        results = replay(envelopes, args.target.rstrip('/'), args.speed, args.workers)
+        request_ids = {envelope['request_id'] for envelope in envelopes}
+        drain_until = time.monotonic() + args.drain
+        while upstream.pending(request_ids) and time.monotonic() < drain_until:
+            time.sleep(0.1)
+    finally:
+        server.shutdown()
+
+    report(results)
+    print(f"\nupstream calls served from recording: {upstream.served}, unmatched: {upstream.missing}")
+    if skipped:
+        print(f"event-stream requests skipped: {skipped}")
+
+
+if __name__ == '__main__':
+    main()
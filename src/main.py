@@ -10,23 +10,43 @@ import sqlite3
 from datetime import datetime, timedelta
 import threading
 import logging
+import contextvars
 import stripe
+from services.structured_logging import configure_logging, get_request_id, init_request_logging, REQUEST_ID_HEADER
+from services.similarity_cache import SimilarityCache
+from services.session_store import SessionStore
+from services.state_backend import create_state_backend
+from services.json_codec import init_json, loads as json_loads
+from services.traffic_capture import init_traffic_capture, record_external_call
+from services.output_budget import OutputBudgetController, completion_tokens, parse_modes
+from services.upstream import UpstreamError, post_chat_completion, stream_chat_completion
+from services.session_channel import ChannelRegistry, TokenBuffer, format_sse
+from services.deadlines import DEADLINE_HEADER, DeadlineExceeded, cancellation_stats, init_deadlines
+from services.convergence import ConvergenceDetector, STOP, SWITCH
+from services.agent_prober import AgentProber
+from services.prompt_assembly import PromptCacheStats, assemble_messages, prefix_tokens, stable_prefix
 # Fix Stripe version compatibility
 stripe.api_version = '2020-08-27'
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+init_json(app)
+init_request_logging(app)
+
+# Opt-in traffic capture for replay (see benchmarks/replay_capture.py)
+if os.getenv('TRAFFIC_CAPTURE_DIR'):
+    init_traffic_capture(app, os.getenv('TRAFFIC_CAPTURE_DIR'), float(os.getenv('TRAFFIC_CAPTURE_SAMPLE', 1.0)))
 
 # Ã°ÂŸÂ”Â§ ENHANCED CORS CONFIGURATION - FIXED
 CORS(app, 
      origins=["*"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin"],
+     allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Accept", "Origin", "X-User-ID", "Last-Event-ID", DEADLINE_HEADER, REQUEST_ID_HEADER],
      supports_credentials=True,
-     expose_headers=["Content-Type", "Authorization"])
+     expose_headers=["Content-Type", "Authorization", REQUEST_ID_HEADER])
 
 # Ã°ÂŸÂ”Â§ ENHANCED CONFIGURATION
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
@@ -35,16 +55,62 @@ STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'https://silly-conkies-f4cfde.netlify.app')
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'promptlink.db')
 
+# Near-duplicate prompt cache (opt-in per agent, e.g. "gpt4o,llama" or "*")
+SIMILARITY_CACHE_AGENTS = [a.strip() for a in os.getenv('SIMILARITY_CACHE_AGENTS', '').split(',') if a.strip()]
+SIMILARITY_CACHE_THRESHOLD = float(os.getenv('SIMILARITY_CACHE_THRESHOLD', 0.9))
+SIMILARITY_CACHE_MIN_JACCARD = float(os.getenv('SIMILARITY_CACHE_MIN_JACCARD', 1.0))
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.getenv('SIMILARITY_CACHE_MAX_ENTRIES', 2048))
+SIMILARITY_CACHE_MAX_BYTES = int(os.getenv('SIMILARITY_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+SIMILARITY_CACHE_TTL = int(os.getenv('SIMILARITY_CACHE_TTL', 3600))
+
+# Active session store limits (cold sessions spill to the sessions table)
+SESSION_STORE_MAX_SESSIONS = int(os.getenv('SESSION_STORE_MAX_SESSIONS', 5000))
+SESSION_STORE_MEMORY_BUDGET = int(os.getenv('SESSION_STORE_MEMORY_BUDGET', 64 * 1024 * 1024))
+# Seconds between writes of changed hot sessions to SQLite (they are also written at exit)
+SESSION_STORE_FLUSH_INTERVAL = float(os.getenv('SESSION_STORE_FLUSH_INTERVAL', 30))
+
+# Shared state for counters and cache invalidation across workers/replicas
+STATE_BACKEND_URL = os.getenv('STATE_BACKEND_URL') or os.getenv('REDIS_URL', '')
+CACHE_INVALIDATION_CHANNEL = 'promptlink:prompt-cache:invalidate'
+
+# Adaptive max_tokens: percentile of observed reply lengths plus headroom, capped per agent
+OUTPUT_BUDGET_PERCENTILE = float(os.getenv('OUTPUT_BUDGET_PERCENTILE', 95))
+OUTPUT_BUDGET_HEADROOM = float(os.getenv('OUTPUT_BUDGET_HEADROOM', 1.25))
+OUTPUT_BUDGET_MIN_SAMPLES = int(os.getenv('OUTPUT_BUDGET_MIN_SAMPLES', 20))
+OUTPUT_BUDGET_MAX_CONTINUATIONS = int(os.getenv('OUTPUT_BUDGET_MAX_CONTINUATIONS', 2))
+# Modes tracked separately (comma-separated); other client-supplied modes share one bucket
+OUTPUT_BUDGET_MODES = parse_modes(os.getenv('OUTPUT_BUDGET_MODES', ''))
+
+# Session channels (one event stream per two-agent session)
+CHANNEL_MAX_CHANNELS = int(os.getenv('CHANNEL_MAX_CHANNELS', 1000))
+CHANNEL_MAX_EVENTS = int(os.getenv('CHANNEL_MAX_EVENTS', 2000))
+CHANNEL_PUSH_INTERVAL = int(os.getenv('CHANNEL_PUSH_INTERVAL', 30))
+# Seconds a channel may go without any connected reader before in-flight streams are aborted
+CHANNEL_ABANDON_GRACE = float(os.getenv('CHANNEL_ABANDON_GRACE', 10))
+
+# Early stop for autonomous rounds once turns stop adding new content
+CONVERGENCE_THRESHOLD = float(os.getenv('CONVERGENCE_THRESHOLD', 0.2))
+CONVERGENCE_WINDOW = int(os.getenv('CONVERGENCE_WINDOW', 4))
+CONVERGENCE_PATIENCE = int(os.getenv('CONVERGENCE_PATIENCE', 2))
+
+# Background availability probes (one-token completions); 0 disables probing
+AGENT_PROBE_INTERVAL = float(os.getenv('AGENT_PROBE_INTERVAL', 0))
+AGENT_PROBE_TIMEOUT = float(os.getenv('AGENT_PROBE_TIMEOUT', 15))
+AGENT_PROBE_SLOW_MS = int(os.getenv('AGENT_PROBE_SLOW_MS', 8000))
+
 # Initialize Stripe with error checking
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
+    # Replays point this at the recorded mock (benchmarks/replay_capture.py)
+    if os.getenv('STRIPE_API_BASE'):
+        stripe.api_base = os.getenv('STRIPE_API_BASE')
     print(f"Stripe initialized with key: {STRIPE_SECRET_KEY[:7]}...")
 else:
     print("ERROR: STRIPE_SECRET_KEY not found in environment variables!")
     stripe = None
 
 # Ã°ÂŸÂŒÂ API ENDPOINTS
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
 
 # Ã°ÂŸÂ¤Â– ALL 10 AI AGENTS - COMPLETE CONFIGURATION
 AGENT_MODELS = {
@@ -120,6 +186,15 @@ AGENT_MODELS = {
     }
 }
 
+# Shared system preamble; must stay byte-identical between turns so providers can cache it
+PLATFORM_INSTRUCTIONS = (
+    "You are one of several AI agents on PromptLink, a platform where users compare and combine "
+    "answers from different models, sometimes in autonomous multi-round conversations between two agents. "
+    "Answer the latest message directly; when it is another agent's reply, build on it instead of repeating it. "
+    "Prefer concrete, accurate and actionable content; say so plainly when you are unsure. "
+    "Use Markdown for structure when it helps readability, and keep replies focused on what was asked."
+)
+
 # Ã°ÂŸÂŽÂ­ HUMAN SIMULATOR ENHANCED PERSONALITIES
 HUMAN_PERSONALITIES = {
     "analytical": {
@@ -169,7 +244,8 @@ PAYMENT_PLANS = {
         "daily_limit": 100,
         "features": ["3 AI Agents", "Basic Chat", "100 Daily Credits", "Community Support"],
         "human_simulator": False,
-        "max_rounds": 5
+        "max_rounds": 5,
+        "deadline_seconds": 30
     },
     "basic": {
         "amount": 1900,
@@ -178,7 +254,8 @@ PAYMENT_PLANS = {
         "daily_limit": 500,
         "features": ["5 AI Agents", "Basic Orchestration", "Standard Support", "Export Conversations"],
         "human_simulator": True,
-        "max_rounds": 15
+        "max_rounds": 15,
+        "deadline_seconds": 60
     },
     "professional": {
         "amount": 9900,
@@ -187,7 +264,8 @@ PAYMENT_PLANS = {
         "daily_limit": 2000,
         "features": ["All 10 AI Agents", "Advanced Orchestration", "Human Simulator", "Priority Support", "API Access"],
         "human_simulator": True,
-        "max_rounds": 30
+        "max_rounds": 30,
+        "deadline_seconds": 120
     },
     "expert": {
         "amount": 49900,
@@ -196,10 +274,57 @@ PAYMENT_PLANS = {
         "daily_limit": 10000,
         "features": ["All AI Agents", "Enterprise Features", "Custom Integrations", "Dedicated Support", "White-label Options"],
         "human_simulator": True,
-        "max_rounds": 50
+        "max_rounds": 50,
+        "deadline_seconds": 300
     }
 }
 
+# Per-agent near-duplicate caches, created only for opted-in agents
+PROMPT_CACHES = {
+    agent_id: SimilarityCache(
+        threshold=SIMILARITY_CACHE_THRESHOLD,
+        min_jaccard=SIMILARITY_CACHE_MIN_JACCARD,
+        max_entries=SIMILARITY_CACHE_MAX_ENTRIES,
+        max_bytes=SIMILARITY_CACHE_MAX_BYTES,
+        ttl=SIMILARITY_CACHE_TTL
+    )
+    for agent_id in AGENT_MODELS
+    if agent_id in SIMILARITY_CACHE_AGENTS or '*' in SIMILARITY_CACHE_AGENTS
+}
+
+STATE_BACKEND = create_state_backend(STATE_BACKEND_URL)
+
+CHANNELS = ChannelRegistry(max_channels=CHANNEL_MAX_CHANNELS, max_events=CHANNEL_MAX_EVENTS)
+
+def user_plan(user_id):
+    """Plan recorded for a user by the payment webhook, free by default"""
+    plan = STATE_BACKEND.get(f"promptlink:plan:{user_id}")
+    return plan if plan in PAYMENT_PLANS else 'free'
+
+# Only routes that call upstream pay for the plan lookup
+init_deadlines(
+    app,
+    lambda: PAYMENT_PLANS[user_plan(request.headers.get('X-User-ID', 'anonymous'))]['deadline_seconds'],
+    endpoints={'chat', 'channel_send', 'run_human_simulator'},
+    fallback_seconds=PAYMENT_PLANS['free']['deadline_seconds']
+)
+
+OUTPUT_BUDGETS = OutputBudgetController(
+    percentile=OUTPUT_BUDGET_PERCENTILE,
+    headroom=OUTPUT_BUDGET_HEADROOM,
+    min_samples=OUTPUT_BUDGET_MIN_SAMPLES,
+    max_continuations=OUTPUT_BUDGET_MAX_CONTINUATIONS,
+    modes=OUTPUT_BUDGET_MODES
+)
+
+def _invalidate_prompt_caches(agent_id):
+    """Clear local prompt caches when any replica publishes an invalidation"""
+    for cache_agent, cache in PROMPT_CACHES.items():
+        if agent_id in ('*', cache_agent):
+            cache.clear()
+
+STATE_BACKEND.subscribe(CACHE_INVALIDATION_CHANNEL, _invalidate_prompt_caches)
+
 # Database initialization
 def init_database():
     """Initialize SQLite database with user credits table"""
@@ -234,11 +359,17 @@ def init_database():
         conn.close()
         logger.info("Database initialized successfully")
     except Exception as e:
-        logger.error(f"Database initialization error: {e}")
+        logger.error("Database initialization error: %s", e)
 
 # Initialize database on startup
 init_database()
 
+SESSION_STORE = SessionStore(
+    DATABASE_PATH,
+    max_sessions=SESSION_STORE_MAX_SESSIONS,
+    memory_budget=SESSION_STORE_MEMORY_BUDGET
+).start_flushing(SESSION_STORE_FLUSH_INTERVAL)
+
 # Ã°ÂŸÂÂ  HOME ROUTE
 @app.route('/', methods=['GET'])
 def home():
@@ -284,12 +415,67 @@ def health_check():
 @app.route('/api/agents', methods=['GET'])
 def get_agents():
     """Get all available AI agents"""
+    agents = {}
+    for agent_id, agent in AGENT_MODELS.items():
+        availability = AGENT_PROBER.snapshot(agent['model'])
+        agents[agent_id] = {**agent, "status": availability['status'], "availability": availability}
     return jsonify({
-        "agents": AGENT_MODELS,
+        "agents": agents,
         "total_agents": len(AGENT_MODELS),
+        "probing": AGENT_PROBE_INTERVAL > 0,
         "status": "active"
     })
 
+def openrouter_headers():
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "X-Title": "PromptLink AI Platform"
+    }
+
+PROMPT_CACHE_STATS = PromptCacheStats()
+
+def agent_messages(agent_id, message, instructions=()):
+    """Platform and persona instructions as the cacheable prefix, then the new message.
+
+    instructions must not vary per turn.
+    """
+    agent = AGENT_MODELS[agent_id]
+    persona = f"You are {agent['name']}: {agent['description']}."
+    prefix = stable_prefix(PLATFORM_INSTRUCTIONS, persona, *instructions)
+    return assemble_messages(agent['model'], prefix, message)
+
+def complete_for_agent(agent_id, message, mode, instructions=()):
+    """Run one completion for an agent under its learned output budget; returns (response, content)"""
+    agent = AGENT_MODELS[agent_id]
+    headers = openrouter_headers()
+    messages = agent_messages(agent_id, message, instructions)
+    payload = {"model": agent['model'], "messages": messages}
+    return OUTPUT_BUDGETS.complete(
+        agent_id, mode, agent['max_tokens'],
+        lambda body: post_chat_completion(OPENROUTER_BASE_URL, headers, body),
+        payload,
+        on_usage=lambda usage: PROMPT_CACHE_STATS.record(agent['model'], usage, prefix_tokens(messages))
+    )
+
+def probe_model(model):
+    """One-token completion used by the availability prober"""
+    response = post_chat_completion(OPENROUTER_BASE_URL, openrouter_headers(), {
+        "model": model,
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 1
+    }, timeout=AGENT_PROBE_TIMEOUT)
+    return response.status_code == 200, response.status_code
+
+AGENT_PROBER = AgentProber(
+    [agent['model'] for agent in AGENT_MODELS.values()],
+    probe_model,
+    interval=AGENT_PROBE_INTERVAL,
+    slow_ms=AGENT_PROBE_SLOW_MS
+).start()
+
+def agent_usable(agent_id):
+    return agent_id in AGENT_MODELS and AGENT_PROBER.is_usable(AGENT_MODELS[agent_id]['model'])
+
 # Ã°ÂŸÂ’Â¬ CHAT ENDPOINT
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -298,6 +484,8 @@ def chat():
         data = request.get_json()
         agent_id = data.get('agent', 'gpt4o')
         message = data.get('message', '')
+        session_id = data.get('session_id')
+        mode = data.get('mode', 'general')
         
         if agent_id not in AGENT_MODELS:
             return jsonify({'error': 'Invalid agent selected'}), 400
@@ -307,39 +495,76 @@ def chat():
         
         agent = AGENT_MODELS[agent_id]
         
-        # Make request to OpenRouter
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "X-Title": "PromptLink AI Platform"
-        }
+        if session_id:
+            SESSION_STORE.append_message(session_id, 'user', message)
         
-        payload = {
-            "model": agent['model'],
-            "messages": [{"role": "user", "content": message}],
-            "max_tokens": agent['max_tokens']
-        }
+        # Completions are only reused within one user's own history
+        user_id = request.headers.get('X-User-ID')
+        cache = PROMPT_CACHES.get(agent_id) if user_id else None
+        if cache is not None:
+            cached = cache.get(message, scope=user_id)
+            if cached is not None:
+                if session_id:
+                    SESSION_STORE.append_message(session_id, 'assistant', cached, agent=agent_id)
+                return jsonify({
+                    'response': cached,
+                    'agent': agent['name'],
+                    'cached': True,
+                    'success': True
+                })
         
-        response = requests.post(
-            f"{OPENROUTER_BASE_URL}/chat/completions",
-            headers=headers,
-            json=payload
-        )
+        # Make request to OpenRouter
+        response, content = complete_for_agent(agent_id, message, mode)
         
         if response.status_code == 200:
-            result = response.json()
+            if cache is not None:
+                cache.put(message, content, scope=user_id)
+            if session_id:
+                SESSION_STORE.append_message(session_id, 'assistant', content, agent=agent_id)
             return jsonify({
-                'response': result['choices'][0]['message']['content'],
+                'response': content,
                 'agent': agent['name'],
+                'cached': False,
                 'success': True
             })
         else:
             return jsonify({'error': 'AI service temporarily unavailable'}), 503
             
+    except DeadlineExceeded:
+        return jsonify({'error': 'Request deadline exceeded'}), 504
     except Exception as e:
-        logger.error(f"Chat error: {e}")
+        logger.error("Chat error: %s", e)
         return jsonify({'error': 'Chat processing failed'}), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get near-duplicate prompt cache statistics per agent"""
+    return jsonify({
+        'caches': {agent_id: cache.stats() for agent_id, cache in PROMPT_CACHES.items()},
+        'enabled_agents': list(PROMPT_CACHES.keys())
+    })
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Clear prompt caches for one agent (or all) on every replica"""
+    data = request.get_json(silent=True) or {}
+    agent_id = data.get('agent', '*')
+    STATE_BACKEND.publish(CACHE_INVALIDATION_CHANNEL, agent_id)
+    return jsonify({'success': True, 'agent': agent_id})
+
+@app.route('/api/budgets/stats', methods=['GET'])
+def get_budget_stats():
+    """Get learned output budgets and truncation rates per agent and mode"""
+    return jsonify({
+        'budgets': {
+            agent_id: {
+                mode: {**stats, 'next_max_tokens': OUTPUT_BUDGETS.budget(agent_id, mode, AGENT_MODELS[agent_id]['max_tokens'])}
+                for mode, stats in modes.items()
+            }
+            for agent_id, modes in OUTPUT_BUDGETS.stats().items()
+        }
+    })
+
 # Ã°ÂŸÂ'Â³ STRIPE PAYMENT ENDPOINTS - FIXED VERSION (REMOVED DUPLICATE)
 @app.route('/api/payments/create-checkout', methods=['POST', 'OPTIONS'])
 def create_checkout_session():
@@ -349,13 +574,11 @@ def create_checkout_session():
         
     try:
         # Debug logging
-        logger.info(f"STRIPE_SECRET_KEY exists: {bool(STRIPE_SECRET_KEY)}")
-        logger.info(f"STRIPE_SECRET_KEY length: {len(STRIPE_SECRET_KEY) if STRIPE_SECRET_KEY else 0}")
-        logger.info(f"stripe module: {stripe}")
-        logger.info(f"stripe.api_key: {getattr(stripe, 'api_key', 'NOT SET')}")
+        logger.debug("STRIPE_SECRET_KEY exists: %s", bool(STRIPE_SECRET_KEY))
+        logger.debug("stripe module: %s", stripe)
         
         data = request.get_json()
-        logger.info(f"Received data: {data}")
+        logger.info("Received data: %s", data)
         
         plan_type = data.get('plan_id', 'basic')  # ← FIXED: Changed 'plan' to 'plan_id'
         email = data.get('email', 'user@example.com')  # Fallback email
@@ -364,7 +587,7 @@ def create_checkout_session():
             return jsonify({'error': 'Invalid plan type'}), 400
             
         plan = PAYMENT_PLANS[plan_type]
-        logger.info(f"Selected plan: {plan}")
+        logger.info("Selected plan: %s", plan_type)
         
         # Handle free plan
         if plan['amount'] == 0:
@@ -381,30 +604,40 @@ def create_checkout_session():
             
         # Create Stripe checkout session
         logger.info("About to create Stripe session...")
-        session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': plan['name'],
-                        'description': f"{plan['credits']} AI Credits - {', '.join(plan['features'][:3])}",
+        stripe_url = f"{stripe.api_base}/v1/checkout/sessions"
+        stripe_started = time.perf_counter()
+        try:
+            session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=[{
+                    'price_data': {
+                        'currency': 'usd',
+                        'product_data': {
+                            'name': plan['name'],
+                            'description': f"{plan['credits']} AI Credits - {', '.join(plan['features'][:3])}",
+                        },
+                        'unit_amount': plan['amount'],
                     },
-                    'unit_amount': plan['amount'],
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=f"{FRONTEND_URL}?session_id={{CHECKOUT_SESSION_ID}}&success=true",
-            cancel_url=f"{FRONTEND_URL}?canceled=true",
-            customer_email=email,
-            metadata={
-                'plan': plan_type,
-                'credits': plan['credits']
-            }
-        )
-        
-        logger.info(f"Stripe session created: {session.id}")
+                    'quantity': 1,
+                }],
+                mode='payment',
+                success_url=f"{FRONTEND_URL}?session_id={{CHECKOUT_SESSION_ID}}&success=true",
+                cancel_url=f"{FRONTEND_URL}?canceled=true",
+                customer_email=email,
+                metadata={
+                    'plan': plan_type,
+                    'credits': plan['credits'],
+                    'request_id': get_request_id(),
+                    'user_id': request.headers.get('X-User-ID', 'anonymous')
+                }
+            )
+        except stripe.error.StripeError as e:
+            record_external_call(stripe_url, e.http_status or 502, time.perf_counter() - stripe_started, e.http_body)
+            raise
+        record_external_call(stripe_url, session.last_response.code, time.perf_counter() - stripe_started,
+                             session.last_response.body)
+
+        logger.info("Stripe session created: %s", session.id)
         return jsonify({
             'checkout_url': session.url,
             'session_id': session.id,
@@ -412,12 +645,14 @@ def create_checkout_session():
         })
         
     except Exception as e:
-        logger.error(f"Full error details: {type(e).__name__}: {str(e)}")
-        logger.error(f"Error args: {e.args}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.exception("Checkout failed: %s: %s", type(e).__name__, e)
         return jsonify({'error': 'Payment processing failed. Please try again.'}), 500
 
+def credit_balance(user_id, plan=None):
+    """Remaining credits for a user: their plan's allowance minus the shared usage counter"""
+    plan = plan or PAYMENT_PLANS[user_plan(user_id)]
+    return plan['credits'] - int(STATE_BACKEND.get(f"promptlink:credits_used:{user_id}") or 0)
+
 @app.route('/api/user/credits', methods=['GET', 'OPTIONS'])
 def get_user_credits():
     """Get user credits"""
@@ -425,17 +660,59 @@ def get_user_credits():
         return jsonify({'status': 'ok'}), 200
         
     try:
-        # For now, return default credits - in production you'd get from database
+        user_id = request.headers.get('X-User-ID', 'anonymous')
+        plan_type = user_plan(user_id)
+        plan = PAYMENT_PLANS[plan_type]
         return jsonify({
-            'credits': 2500,
-            'plan': 'free',
-            'daily_limit': 500,
+            'credits': credit_balance(user_id, plan),
+            'plan': plan_type,
+            'daily_limit': plan['daily_limit'],
             'success': True
         })
     except Exception as e:
-        logger.error(f"Credits fetch error: {e}")
+        logger.error("Credits fetch error: %s", e)
         return jsonify({'error': 'Failed to fetch credits'}), 500
 
+@app.route('/api/user/consume-credits', methods=['POST', 'OPTIONS'])
+def consume_user_credits():
+    """Atomically consume credits against the balance and daily limit"""
+    if request.method == 'OPTIONS':
+        return jsonify({'status': 'ok'}), 200
+        
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = request.headers.get('X-User-ID', 'anonymous')
+        amount = max(1, int(data.get('amount', 1)))
+        plan = PAYMENT_PLANS[user_plan(user_id)]
+        
+        used_key = f"promptlink:credits_used:{user_id}"
+        daily_key = f"promptlink:daily_credits:{user_id}:{datetime.utcnow().date().isoformat()}"
+        
+        daily_used = STATE_BACKEND.incr(daily_key, amount, ttl=86400)
+        if daily_used > plan['daily_limit']:
+            STATE_BACKEND.incr(daily_key, -amount)
+            return jsonify({'error': 'Daily credit limit reached', 'success': False}), 402
+        
+        used = STATE_BACKEND.incr(used_key, amount)
+        if used > plan['credits']:
+            STATE_BACKEND.incr(used_key, -amount)
+            STATE_BACKEND.incr(daily_key, -amount)
+            return jsonify({'error': 'Insufficient credits', 'success': False}), 402
+        
+        session_id = data.get('session_id')
+        channel = CHANNELS.get(session_id, create=False) if session_id else None
+        if channel is not None:
+            channel.publish('credits', {'credits': plan['credits'] - used, 'daily_limit': plan['daily_limit']}, block=False)
+        
+        return jsonify({
+            'remaining_credits': plan['credits'] - used,
+            'consumed': amount,
+            'success': True
+        })
+    except Exception as e:
+        logger.error("Credits consume error: %s", e)
+        return jsonify({'error': 'Failed to consume credits'}), 500
+
 @app.route('/api/webhook', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhooks"""
@@ -447,7 +724,7 @@ def stripe_webhook():
         # event = stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
         
         # For now, process the event directly
-        event = json.loads(payload)
+        event = json_loads(payload)
         
         if event['type'] == 'checkout.session.completed':
             session = event['data']['object']
@@ -456,7 +733,12 @@ def stripe_webhook():
             plan_type = session['metadata'].get('plan', 'basic')
             credits = int(session['metadata'].get('credits', 5000))
             
-            logger.info(f"Payment completed for plan: {plan_type}, credits: {credits}")
+            logger.info("Payment completed for plan: %s, credits: %s", plan_type, credits,
+                        extra={'checkout_request_id': session['metadata'].get('request_id')})
+            
+            user_id = session['metadata'].get('user_id')
+            if user_id and plan_type in PAYMENT_PLANS:
+                STATE_BACKEND.set(f"promptlink:plan:{user_id}", plan_type)
             
             # Here you would update the database with the new credits
             # update_user_credits(customer_id, credits)
@@ -464,7 +746,7 @@ def stripe_webhook():
         return jsonify({'status': 'success'})
         
     except Exception as e:
-        logger.error(f"Webhook error: {e}")
+        logger.error("Webhook error: %s", e)
         return jsonify({'error': str(e)}), 400
 
 # Ã°ÂŸÂ"Â§ ADDITIONAL UTILITY ENDPOINTS
@@ -479,7 +761,7 @@ def get_payment_status(session_id):
             'success': True
         })
     except Exception as e:
-        logger.error(f"Payment status error: {e}")
+        logger.error("Payment status error: %s", e)
         return jsonify({'error': 'Failed to retrieve payment status'}), 500
 
 # Ã°ÂŸÂŽÂ­ HUMAN SIMULATOR ENDPOINTS
@@ -497,26 +779,272 @@ def human_simulator():
             return jsonify({'error': 'Invalid personality type'}), 400
             
         # Initialize conversation
-        conversation = {
-            'id': str(uuid.uuid4()),
-            'personality': HUMAN_PERSONALITIES[personality],
-            'rounds': rounds,
-            'agents': agents,
-            'messages': [],
-            'status': 'active'
-        }
+        conversation = SESSION_STORE.create(
+            str(uuid.uuid4()),
+            mode='human_simulator',
+            personality=personality,
+            rounds=rounds,
+            agents=agents,
+            messages=[{'role': 'user', 'content': initial_prompt}] if initial_prompt else []
+        )
         
         return jsonify({
-            'conversation_id': conversation['id'],
+            'conversation_id': conversation.id,
             'status': 'initialized',
             'personality': personality,
             'success': True
         })
         
     except Exception as e:
-        logger.error(f"Human simulator error: {e}")
+        logger.error("Human simulator error: %s", e)
         return jsonify({'error': 'Human simulator initialization failed'}), 500
 
+@app.route('/api/human-simulator/<conversation_id>/run', methods=['POST'])
+def run_human_simulator(conversation_id):
+    """Run autonomous rounds until the round limit, convergence or the request deadline"""
+    try:
+        record = SESSION_STORE.get(conversation_id)
+        if record is None or record.personality not in HUMAN_PERSONALITIES:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        plan = PAYMENT_PLANS[user_plan(request.headers.get('X-User-ID', 'anonymous'))]
+        if not plan['human_simulator']:
+            return jsonify({'error': 'Human Simulator is not included in your plan'}), 403
+        rounds = min(int(data.get('rounds', record.rounds or 5)), plan['max_rounds'])
+        personality = HUMAN_PERSONALITIES[record.personality]
+        # Skip agents the prober currently reports as down or too slow
+        agents = ([a for a in record.agents if agent_usable(a)]
+                  or [a for a in personality['agent_preference'] if agent_usable(a)][:2])
+        if not agents:
+            return jsonify({'error': 'No available agents'}), 503
+        prompt = data.get('prompt') or next((m['content'] for m in record.messages if m['role'] == 'user'), '')
+        
+        if not prompt:
+            return jsonify({'error': 'Prompt is required'}), 400
+        
+        detector = ConvergenceDetector(
+            threshold=CONVERGENCE_THRESHOLD,
+            window=CONVERGENCE_WINDOW,
+            patience=CONVERGENCE_PATIENCE,
+            rotation=len(agents)
+        )
+        channel = CHANNELS.get(conversation_id, create=False)
+        SESSION_STORE.update(conversation_id, status='running')
+        
+        turns = []
+        ended_reason = 'max_rounds'
+        last_reply = prompt
+        for round_number in range(1, rounds + 1):
+            slot = (round_number - 1) % len(agents)
+            agent_id = agents[slot]
+            try:
+                response, content = complete_for_agent(
+                    agent_id, last_reply, 'human_simulator', instructions=(personality['prompt_style'],))
+            except DeadlineExceeded:
+                ended_reason = 'deadline'
+                break
+            if content is None:
+                ended_reason = 'upstream_error'
+                break
+            
+            score, decision = detector.observe(content)
+            SESSION_STORE.append_message(conversation_id, 'assistant', content,
+                                         agent=agent_id, round=round_number, novelty=score)
+            turn = {'round': round_number, 'agent': agent_id, 'response': content,
+                    'novelty': round(score, 4), 'decision': decision}
+            turns.append(turn)
+            if channel is not None:
+                channel.publish('round', turn, block=False)
+            
+            if decision == STOP:
+                ended_reason = 'converged'
+                break
+            if decision == SWITCH:
+                # Bring in a fresh agent for the slot that just repeated itself
+                candidates = [a for a in personality['agent_preference'] + list(AGENT_MODELS)
+                              if a not in agents and agent_usable(a)]
+                if candidates:
+                    agents[slot] = candidates[0]
+                    detector.switched()
+            last_reply = content
+        
+        SESSION_STORE.update(conversation_id, status='completed', agents=tuple(agents))
+        return jsonify({
+            'conversation_id': conversation_id,
+            'rounds_requested': rounds,
+            'rounds_completed': len(turns),
+            'ended_reason': ended_reason,
+            'end_detail': detector.reason() if ended_reason == 'converged' else None,
+            'novelty': detector.scores,
+            'agent_switches': detector.switches,
+            'turns': turns,
+            'success': True
+        })
+        
+    except Exception as e:
+        logger.error("Human simulator run error: %s", e)
+        return jsonify({'error': 'Human simulator run failed'}), 500
+
+@app.route('/api/sessions/stats', methods=['GET'])
+def get_session_store_stats():
+    """Get active session store statistics"""
+    return jsonify(SESSION_STORE.stats())
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Get an active or spilled session"""
+    record = SESSION_STORE.get(session_id)
+    if record is None:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify(record.to_dict())
+
+# SESSION CHANNEL ENDPOINTS
+def _diagnostics():
+    return {
+        "status": "online",
+        "agents_configured": len(AGENT_MODELS),
+        "api_key_configured": bool(OPENROUTER_API_KEY),
+        "active_channels": len(CHANNELS),
+        "hot_sessions": SESSION_STORE.stats()['hot_sessions'],
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _stream_agent_turn(channel, slot, agent_id, message, mode):
+    """Stream one agent's reply into the session channel, continuing it if cut off for length"""
+    agent = AGENT_MODELS[agent_id]
+    headers = openrouter_headers()
+    payload = {
+        "model": agent['model'],
+        "messages": agent_messages(agent_id, message),
+        "stream_options": {"include_usage": True}
+    }
+    
+    channel.publish('status', {'slot': slot, 'agent': agent_id, 'state': 'working'})
+    buffer = TokenBuffer(channel, slot, agent_id)
+    abandoned = lambda: channel.abandoned(CHANNEL_ABANDON_GRACE)
+    
+    def attempt(body):
+        """Stream one call into the channel; None when the stream failed or was abandoned"""
+        parts, finish_reason, usage = [], None, None
+        try:
+            for chunk in stream_chat_completion(OPENROUTER_BASE_URL, headers, body, timeout=120, cancelled=abandoned):
+                if chunk['delta']:
+                    parts.append(chunk['delta'])
+                    buffer.add(chunk['delta'])
+                finish_reason = chunk['finish_reason'] or finish_reason
+                usage = chunk['usage'] or usage
+        except UpstreamError as e:
+            logger.error("Channel stream error for %s: %s", agent_id, e)
+            return None
+        finally:
+            buffer.flush()
+        if finish_reason is None and abandoned():
+            return None
+        PROMPT_CACHE_STATS.record(agent['model'], usage, prefix_tokens(body['messages']))
+        content = ''.join(parts)
+        return content, completion_tokens(usage, content), finish_reason
+    
+    error = 'AI service temporarily unavailable'
+    try:
+        result = OUTPUT_BUDGETS.run(agent_id, mode, agent['max_tokens'], payload, attempt)
+    except DeadlineExceeded:
+        result, error = None, 'Request deadline exceeded'
+    except Exception as e:
+        logger.error("Channel stream error for %s: %s", agent_id, e)
+        result = None
+    if result is None:
+        if abandoned():
+            channel.publish('status', {'slot': slot, 'agent': agent_id, 'state': 'cancelled'}, block=False)
+        else:
+            channel.publish('status', {'slot': slot, 'agent': agent_id, 'state': 'error', 'error': error})
+        return
+    
+    content, finish_reason = result
+    SESSION_STORE.append_message(channel.session_id, 'assistant', content, agent=agent_id)
+    channel.publish('done', {'slot': slot, 'agent': agent_id, 'content': content, 'finish_reason': finish_reason})
+    channel.publish('status', {'slot': slot, 'agent': agent_id, 'state': 'ready'})
+
+@app.route('/api/channel/<session_id>/send', methods=['POST'])
+def channel_send(session_id):
+    """Send one message to one or both agents; replies stream over the session channel"""
+    try:
+        data = request.get_json()
+        message = data.get('message', '')
+        mode = data.get('mode', 'general')
+        targets = data.get('agents') or {}
+        
+        if not message:
+            return jsonify({'error': 'Message is required'}), 400
+        if not targets or any(agent_id not in AGENT_MODELS for agent_id in targets.values()):
+            return jsonify({'error': 'Invalid agent selected', 'available_agents': list(AGENT_MODELS.keys())}), 400
+        
+        channel = CHANNELS.get(session_id)
+        offset = channel.next_offset
+        SESSION_STORE.append_message(session_id, 'user', message)
+        for slot, agent_id in targets.items():
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run,
+                args=(_stream_agent_turn, channel, slot, agent_id, message, mode),
+                daemon=True
+            ).start()
+        
+        return jsonify({'success': True, 'session_id': session_id, 'offset': offset}), 202
+    except Exception as e:
+        logger.error("Channel send error: %s", e)
+        return jsonify({'error': 'Channel send failed'}), 500
+
+@app.route('/api/channel/<session_id>/events', methods=['GET'])
+def channel_events(session_id):
+    """Server-sent event stream for a session; resumes from ?offset= or Last-Event-ID"""
+    user_id = request.args.get('user_id', 'anonymous')
+    try:
+        if 'offset' in request.args:
+            offset = int(request.args['offset'])
+        elif request.headers.get('Last-Event-ID'):
+            offset = int(request.headers['Last-Event-ID']) + 1
+        else:
+            offset = 0
+    except ValueError:
+        return jsonify({'error': 'offset and Last-Event-ID must be integers'}), 400
+    channel = CHANNELS.get(session_id)
+    
+    def push_status():
+        plan = PAYMENT_PLANS[user_plan(user_id)]
+        channel.publish('credits', {'credits': credit_balance(user_id, plan), 'daily_limit': plan['daily_limit']}, block=False)
+        channel.publish('diagnostics', _diagnostics(), block=False)
+    
+    def generate():
+        push_status()
+        last_push = time.monotonic()
+        for event_offset, event, data in channel.subscribe(offset):
+            yield format_sse(event_offset, event, data)
+            if time.monotonic() - last_push >= CHANNEL_PUSH_INTERVAL:
+                push_status()
+                last_push = time.monotonic()
+    
+    return app.response_class(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get cancellation counters and provider prompt-cache usage"""
+    return jsonify({
+        'cancellations': cancellation_stats(),
+        'prompt_cache': PROMPT_CACHE_STATS.snapshot()
+    })
+
+@app.route('/api/channel/<session_id>/stats', methods=['GET'])
+def channel_stats(session_id):
+    """Get offsets, reader lag and backpressure counters for a session channel"""
+    channel = CHANNELS.get(session_id, create=False)
+    if channel is None:
+        return jsonify({'error': 'Channel not found'}), 404
+    return jsonify(channel.stats())
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
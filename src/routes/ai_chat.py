@@ -7,6 +7,12 @@ from flask import Blueprint, request, jsonify
 import requests
 import os
 import time
+import uuid
+from services.agent_prober import AgentProber
+from services.output_budget import OutputBudgetController, parse_modes
+from services.prompt_assembly import PromptCacheStats, assemble_messages, stable_prefix
+from services.session_store import SessionStore
+from services.upstream import post_chat_completion
 
 ai_bp = Blueprint('ai', __name__)
 
@@ -30,6 +36,41 @@ OPENROUTER_MODELS = {
 API_BASE = os.getenv('OPENAI_API_BASE')
 API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Upper bound on reply length; the budget controller reserves less once it has samples
+MAX_OUTPUT_TOKENS = 1000
+OUTPUT_BUDGETS = OutputBudgetController(
+    percentile=float(os.getenv('OUTPUT_BUDGET_PERCENTILE', 95)),
+    headroom=float(os.getenv('OUTPUT_BUDGET_HEADROOM', 1.25)),
+    min_samples=int(os.getenv('OUTPUT_BUDGET_MIN_SAMPLES', 20)),
+    max_continuations=int(os.getenv('OUTPUT_BUDGET_MAX_CONTINUATIONS', 2)),
+    modes=parse_modes(os.getenv('OUTPUT_BUDGET_MODES', ''))
+)
+PROMPT_CACHE_STATS = PromptCacheStats()
+
+
+def probe_model(model):
+    response = post_chat_completion(API_BASE, {"Authorization": f"Bearer {API_KEY}"}, {
+        "model": model,
+        "messages": [{"role": "user", "content": "ping"}],
+        "max_tokens": 1
+    }, timeout=float(os.getenv('AGENT_PROBE_TIMEOUT', 15)))
+    return response.status_code == 200, response.status_code
+
+
+# Several agent ids share a model, so health is tracked per model
+AGENT_PROBER = AgentProber(
+    OPENROUTER_MODELS.values(),
+    probe_model,
+    interval=float(os.getenv('AGENT_PROBE_INTERVAL', 0)),
+    slow_ms=int(os.getenv('AGENT_PROBE_SLOW_MS', 8000))
+).start()
+
+SESSION_STORE = SessionStore(
+    os.getenv('SESSION_DB_PATH', os.path.join(os.path.dirname(__file__), '..', 'database', 'sessions.db')),
+    max_sessions=int(os.getenv('SESSION_STORE_MAX_SESSIONS', 5000)),
+    memory_budget=int(os.getenv('SESSION_STORE_MEMORY_BUDGET', 64 * 1024 * 1024))
+).start_flushing(float(os.getenv('SESSION_STORE_FLUSH_INTERVAL', 30)))
+
 @ai_bp.route('/health', methods=['GET'])
 def health():
     return jsonify({
@@ -42,6 +83,7 @@ def health():
         "manus_proxy": True,
         "api_base": API_BASE,
         "backend_type": "testing",
+        "prompt_cache": PROMPT_CACHE_STATS.snapshot(),
         "timestamp": time.time()
     })
 
@@ -49,12 +91,14 @@ def health():
 def list_agents():
     agents = []
     for agent_id, model in OPENROUTER_MODELS.items():
+        availability = AGENT_PROBER.snapshot(model)
         agents.append({
             "id": agent_id,
             "name": agent_id.upper(),
             "model": model,
             "provider": "openrouter",
-            "status": "ready"
+            "status": availability['status'],
+            "availability": availability
         })
     
     return jsonify({
@@ -101,37 +145,33 @@ def chat():
         
         # Make real API call to Manus OpenRouter proxy
         headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
+            "Authorization": f"Bearer {API_KEY}"
         }
         
         payload = {
             "model": model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": f"You are {agent_id}, a helpful AI assistant. Provide genuine, thoughtful responses."
-                },
-                {
-                    "role": "user", 
-                    "content": message
-                }
-            ],
-            "max_tokens": 1000,
+            "messages": assemble_messages(
+                model,
+                stable_prefix(f"You are {agent_id}, a helpful AI assistant. Provide genuine, thoughtful responses."),
+                message
+            ),
             "temperature": 0.7
         }
         
         # Real API call
-        response = requests.post(
-            f"{API_BASE}/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
+        response, ai_response = OUTPUT_BUDGETS.complete(
+            agent_id, mode, MAX_OUTPUT_TOKENS,
+            lambda body: post_chat_completion(API_BASE, headers, body, timeout=30),
+            payload,
+            on_usage=lambda usage: PROMPT_CACHE_STATS.record(model, usage)
         )
         
         if response.status_code == 200:
-            result = response.json()
-            ai_response = result['choices'][0]['message']['content'].strip()
+            ai_response = ai_response.strip()
+            
+            if session_id:
+                SESSION_STORE.append_message(session_id, 'user', message)
+                SESSION_STORE.append_message(session_id, 'assistant', ai_response, agent=agent_id)
             
             return jsonify({
                 "status": "success",
@@ -169,7 +209,8 @@ def start_session():
         agent_a = data.get('agent_a')
         agent_b = data.get('agent_b')
         
-        session_id = f"testing_backend_session_{int(time.time())}"
+        session_id = f"testing_backend_session_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        SESSION_STORE.create(session_id, mode=mode, agents=[a for a in (agent_a, agent_b) if a])
         
         return jsonify({
             "status": "success",
@@ -0,0 +1,147 @@
+"""
+Agent availability prober
+A low-rate background thread sends a one-token completion to each model in
+turn and keeps its live status, cold-start latency and recent latencies for
+the agent catalog endpoints.
+
+Regular probes are an interval apart and keep a provider warm, so each round
+one healthy model (in turn) sits out. Its next probe follows two intervals of
+quiet and is the one recorded as a cold start: only successes more than
+cold_after (1.5 intervals by default) after the previous one count.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+UNKNOWN = 'unknown'
+AVAILABLE = 'available'
+SLOW = 'slow'
+DEGRADED = 'degraded'
+UNAVAILABLE = 'unavailable'
+
+
+class _ModelHealth:
+    __slots__ = ('status', 'latencies', 'cold_start_ms', 'last_checked', 'last_ok',
+                 'consecutive_failures', 'last_error', 'probes')
+
+    def __init__(self, window):
+        self.status = UNKNOWN
+        self.latencies = deque(maxlen=window)
+        self.cold_start_ms = None
+        self.last_checked = None
+        self.last_ok = None
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.probes = 0
+
+
+class AgentProber:
+    """Round-robin prober; probe(model) returns (ok, detail) and may raise"""
+
+    def __init__(self, models, probe, interval=300.0, slow_ms=8000, failures_to_down=2,
+                 cold_after=None, window=10):
+        self.models = list(dict.fromkeys(models))
+        self.probe = probe
+        self.interval = interval
+        self.slow_ms = slow_ms
+        self.failures_to_down = failures_to_down
+        # Between one interval (regular probes) and two (after a rest)
+        self.cold_after = interval * 1.5 if cold_after is None else cold_after
+        self.window = window
+        self._health = {model: _ModelHealth(window) for model in self.models}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.models and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='agent-prober', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Spread one round of probes over the interval instead of bursting
+        spacing = self.interval / len(self.models)
+        self._stop.wait(random.uniform(0, spacing))
+        round_number = 0
+        while not self._stop.is_set():
+            resting = self.resting(round_number)
+            for model in self.models:
+                if self._stop.is_set():
+                    return
+                if model != resting:
+                    self.check(model)
+                self._stop.wait(spacing)
+            round_number += 1
+
+    def resting(self, round_number):
+        """Model skipped in this round so its next probe measures a cold start, or None.
+
+        Models take turns, with one round in len(models) + 1 where none rests;
+        models that are not known to be healthy are always probed.
+        """
+        index = round_number % (len(self.models) + 1)
+        if index == len(self.models):
+            return None
+        model = self.models[index]
+        return model if self.status(model) == AVAILABLE else None
+
+    def check(self, model):
+        """Probe one model now and update its health"""
+        started = time.monotonic()
+        try:
+            ok, detail = self.probe(model)
+        except Exception as e:
+            ok, detail = False, type(e).__name__
+        latency_ms = round((time.monotonic() - started) * 1000, 1)
+        self._record(model, ok, latency_ms, detail)
+
+    def _record(self, model, ok, latency_ms, detail=None):
+        now = time.time()
+        with self._lock:
+            health = self._health.setdefault(model, _ModelHealth(self.window))
+            health.probes += 1
+            health.last_checked = now
+            if ok:
+                # A success after a long quiet spell measures the provider's cold start
+                if health.last_ok is None or now - health.last_ok > self.cold_after:
+                    health.cold_start_ms = latency_ms
+                health.last_ok = now
+                health.latencies.append(latency_ms)
+                health.consecutive_failures = 0
+                health.last_error = None
+                health.status = SLOW if latency_ms >= self.slow_ms else AVAILABLE
+            else:
+                health.consecutive_failures += 1
+                health.last_error = detail
+                health.status = UNAVAILABLE if health.consecutive_failures >= self.failures_to_down else DEGRADED
+
+    def status(self, model):
+        with self._lock:
+            health = self._health.get(model)
+            return health.status if health else UNKNOWN
+
+    def is_usable(self, model):
+        """False only for models known to be down or too slow"""
+        return self.status(model) not in (UNAVAILABLE, SLOW)
+
+    def snapshot(self, model):
+        with self._lock:
+            health = self._health.get(model)
+            if health is None:
+                return {'status': UNKNOWN}
+            latencies = sorted(health.latencies)
+            return {
+                'status': health.status,
+                'latency_ms': health.latencies[-1] if health.latencies else None,
+                'latency_p50_ms': latencies[len(latencies) // 2] if latencies else None,
+                'cold_start_ms': health.cold_start_ms,
+                'last_checked': health.last_checked,
+                'consecutive_failures': health.consecutive_failures,
+                'last_error': health.last_error,
+            }
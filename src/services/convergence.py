@@ -0,0 +1,85 @@
+"""
+Convergence detection
+Scores each new turn's novelty as the share of its word n-grams that did not
+appear in the last few turns. Repeated low-novelty turns first trigger an
+agent switch and then an early stop, which waits until the replacement
+agent has had its turn.
+"""
+
+import re
+from collections import deque
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+
+CONTINUE = 'continue'
+SWITCH = 'switch'
+STOP = 'stop'
+
+
+def shingles(text, n=3):
+    """Set of word n-grams over lower-cased alphanumeric tokens"""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def novelty(text, recent, n=3):
+    """Fraction of text's n-grams not already present in any recent turn (1.0 = all new)"""
+    new = shingles(text, n)
+    if not new:
+        return 0.0
+    seen = set()
+    for previous in recent:
+        seen |= previous if isinstance(previous, set) else shingles(previous, n)
+    return len(new - seen) / len(new)
+
+
+class ConvergenceDetector:
+    """Tracks novelty across turns and decides whether to continue, switch agents or stop"""
+
+    def __init__(self, threshold=0.2, window=4, patience=2, min_turns=2, ngram=3, rotation=1):
+        self.threshold = threshold
+        self.patience = patience
+        self.min_turns = min_turns
+        self.ngram = ngram
+        # Agents taking turns in order; a replacement speaks this many turns after the switch
+        self.rotation = rotation
+        self.scores = []
+        self.switches = 0
+        self._recent = deque(maxlen=window)
+        self._low_streak = 0
+        self._hold = 0
+
+    def observe(self, text):
+        """Score a new turn and return (novelty, decision)"""
+        current = shingles(text, self.ngram)
+        score = novelty(text, self._recent, self.ngram) if self._recent else 1.0
+        self._recent.append(current)
+        self.scores.append(round(score, 4))
+        # Every turn, whatever its novelty, brings the replacement's turn closer
+        if self._hold:
+            self._hold -= 1
+
+        if len(self.scores) <= self.min_turns or score >= self.threshold:
+            self._low_streak = 0
+            return score, CONTINUE
+
+        self._low_streak += 1
+        if self._hold:
+            # The replacement agent has not spoken yet
+            return score, CONTINUE
+        if self._low_streak >= self.patience:
+            return score, STOP
+        if self._low_streak == 1:
+            return score, SWITCH
+        return score, CONTINUE
+
+    def switched(self):
+        """Record that a SWITCH decision actually replaced an agent"""
+        self.switches += 1
+        self._hold = self.rotation
+
+    def reason(self):
+        return (f"converged: novelty below {self.threshold} for "
+                f"{self.patience} consecutive turns (last {self.scores[-1] if self.scores else None})")
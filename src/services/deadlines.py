@@ -0,0 +1,91 @@
+"""
+Request deadlines and cancellation accounting
+Requests that call upstream get an absolute deadline (from X-Request-Deadline, capped by
+the caller's plan). Upstream calls derive their timeouts from what is left,
+and abandoned work is counted by reason.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+
+from flask import g, request
+
+DEADLINE_HEADER = 'X-Request-Deadline'
+
+logger = logging.getLogger(__name__)
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+_counters = {'deadline_exceeded': 0, 'client_disconnect': 0}
+_counters_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before the upstream call could finish"""
+
+
+def remaining():
+    """Seconds left before the current deadline, or None when there is none"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def upstream_timeout(cap=None):
+    """Timeout for the next upstream call: the smaller of cap and the time left"""
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if cap is None else min(cap, left)
+
+
+def check():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+
+
+def record_cancellation(reason):
+    with _counters_lock:
+        _counters[reason] = _counters.get(reason, 0) + 1
+
+
+def cancellation_stats():
+    with _counters_lock:
+        return dict(_counters)
+
+
+def init_deadlines(app, default_seconds, endpoints=None, fallback_seconds=30):
+    """Bind a deadline to requests for endpoints (all when None); default_seconds() returns the plan's ceiling.
+
+    fallback_seconds applies when default_seconds() fails, e.g. the plan store is down.
+    """
+
+    @app.before_request
+    def _bind_deadline():
+        if request.method == 'OPTIONS' or (endpoints is not None and request.endpoint not in endpoints):
+            return
+        try:
+            budget = default_seconds()
+        except Exception as e:
+            logger.warning("Deadline lookup failed, using %ss: %s", fallback_seconds, e)
+            budget = fallback_seconds
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                # Clients may ask for less time than their plan allows, never more
+                budget = min(budget, max(0.0, float(header) / 1000.0))
+            except ValueError:
+                pass
+        g._deadline_token = _deadline.set(time.monotonic() + budget)
+
+    @app.teardown_request
+    def _unbind_deadline(exc):
+        token = g.pop('_deadline_token', None)
+        if token is not None:
+            _deadline.reset(token)
@@ -0,0 +1,64 @@
+"""
+JSON codec
+Uses orjson when it is installed and falls back to the standard library.
+Encoding returns bytes and decoding accepts bytes so request bodies,
+upstream replies and responses never take an extra str round trip.
+"""
+
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def dumps(obj, default=None, sort_keys=False):
+    """Serialize obj to UTF-8 JSON bytes"""
+    if HAS_ORJSON:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(obj, default=default, sort_keys=sort_keys,
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_response(response):
+    """Decode a requests.Response body straight from its bytes"""
+    return loads(response.content)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by the codec above"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, default=self.default, sort_keys=self.sort_keys).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            dumps(obj, default=self.default, sort_keys=self.sort_keys),
+            mimetype=self.mimetype
+        )
+
+
+def init_json(app):
+    """Install the fast provider on app when orjson is available"""
+    if HAS_ORJSON:
+        app.json = FastJSONProvider(app)
+    return app.json
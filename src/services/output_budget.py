@@ -0,0 +1,180 @@
+"""
+Adaptive output budgets
+Learns how long each agent's replies actually are per mode and reserves
+max_tokens from a percentile of that distribution plus headroom instead of
+the model's hard ceiling. Replies cut off for length are continued.
+Modes come from clients, so only known modes get their own statistics;
+anything else is pooled under OTHER_MODE.
+"""
+
+import math
+import threading
+from collections import deque
+
+from .deadlines import DeadlineExceeded
+from .json_codec import decode_response
+
+CONTINUE_PROMPT = "Continue exactly where you left off. Do not repeat anything you already wrote."
+
+# Orchestration and advisor modes the frontend sends, plus the simulator's own
+DEFAULT_MODES = frozenset({
+    'general', 'manual', 'autonomous', 'human-sim-a', 'human-sim-b', 'human-sim-dual',
+    'discussion', 'brainstorm', 'debate', 'strategy', 'technical', 'compliance',
+    'human_simulator',
+})
+OTHER_MODE = 'other'
+
+
+def parse_modes(spec):
+    """Parse a comma-separated mode list; DEFAULT_MODES when empty"""
+    modes = {mode.strip() for mode in (spec or '').split(',') if mode.strip()}
+    return frozenset(modes) or DEFAULT_MODES
+
+
+class _Stats:
+    __slots__ = ('lengths', 'requests', 'truncated', 'continued', 'still_truncated')
+
+    def __init__(self, window):
+        self.lengths = deque(maxlen=window)
+        self.requests = 0
+        self.truncated = 0
+        self.continued = 0
+        self.still_truncated = 0
+
+
+class OutputBudgetController:
+    """Per (agent, mode) response-length tracker that picks max_tokens"""
+
+    def __init__(self, percentile=95, headroom=1.25, min_tokens=256, window=200,
+                 min_samples=20, max_continuations=2, modes=DEFAULT_MODES):
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self.window = window
+        self.min_samples = min_samples
+        self.max_continuations = max_continuations
+        self.modes = frozenset(modes)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def mode_key(self, mode):
+        """The statistics bucket for a client-supplied mode"""
+        return mode if mode in self.modes else OTHER_MODE
+
+    def _get(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _Stats(self.window)
+        return stats
+
+    def budget(self, agent_id, mode, cap):
+        """max_tokens to reserve for the next reply; the cap until enough samples exist"""
+        with self._lock:
+            stats = self._stats.get((agent_id, self.mode_key(mode)))
+            lengths = sorted(stats.lengths) if stats else []
+        if len(lengths) < self.min_samples:
+            return cap
+        index = min(len(lengths) - 1, math.ceil(self.percentile / 100.0 * len(lengths)) - 1)
+        # Round up to a multiple of 64 so small shifts don't change the reservation
+        target = int(math.ceil(lengths[index] * self.headroom / 64.0) * 64)
+        return max(self.min_tokens, min(cap, target))
+
+    def observe(self, agent_id, mode, tokens, truncated=False, continuations=0, still_truncated=False):
+        with self._lock:
+            stats = self._get((agent_id, self.mode_key(mode)))
+            stats.lengths.append(tokens)
+            stats.requests += 1
+            stats.truncated += bool(truncated)
+            stats.continued += continuations
+            stats.still_truncated += bool(still_truncated)
+
+    def run(self, agent_id, mode, cap, payload, attempt):
+        """Run a reply under the learned budget, continuing it while it is cut off for length.
+
+        attempt(payload) makes one call and returns (content, tokens, finish_reason),
+        or None if the call failed. Returns (content, finish_reason), or None when
+        the first call failed. A failed or timed-out continuation keeps what was
+        already written; exceptions from the first call propagate.
+        """
+        payload = {**payload, 'max_tokens': self.budget(agent_id, mode, cap)}
+        result = attempt(payload)
+        if result is None:
+            return None
+
+        content, tokens, finish_reason = result
+        truncated = finish_reason == 'length'
+        continuations = 0
+        while finish_reason == 'length' and continuations < self.max_continuations:
+            follow_up = {
+                **payload,
+                'messages': payload['messages'] + [
+                    {'role': 'assistant', 'content': content},
+                    {'role': 'user', 'content': CONTINUE_PROMPT}
+                ],
+                'max_tokens': cap
+            }
+            try:
+                result = attempt(follow_up)
+            except DeadlineExceeded:
+                # Out of time: return what we have rather than nothing
+                break
+            if result is None:
+                break
+            piece, piece_tokens, finish_reason = result
+            content += piece
+            tokens += piece_tokens
+            continuations += 1
+
+        self.observe(agent_id, mode, tokens, truncated, continuations, finish_reason == 'length')
+        return content, finish_reason
+
+    def complete(self, agent_id, mode, cap, send, payload, on_usage=None):
+        """Run a completion under the learned budget, continuing replies cut off for length.
+
+        send(payload) must return a requests.Response. Returns (response, content);
+        content is None when the first call did not succeed. on_usage, if given,
+        receives the provider's usage block for every successful call.
+        """
+        responses = []
+
+        def attempt(body):
+            response = send(body)
+            if not responses or response.status_code == 200:
+                responses.append(response)
+            if response.status_code != 200:
+                return None
+            return _read_choice(decode_response(response), on_usage)
+
+        result = self.run(agent_id, mode, cap, payload, attempt)
+        return responses[-1], result[0] if result else None
+
+    def stats(self):
+        with self._lock:
+            items = [(key, stats, sorted(stats.lengths)) for key, stats in self._stats.items()]
+        report = {}
+        for (agent_id, mode), stats, lengths in items:
+            report.setdefault(agent_id, {})[mode] = {
+                'requests': stats.requests,
+                'samples': len(lengths),
+                'median_tokens': lengths[len(lengths) // 2] if lengths else None,
+                'max_tokens_observed': lengths[-1] if lengths else None,
+                'truncated': stats.truncated,
+                'truncation_rate': round(stats.truncated / stats.requests, 4) if stats.requests else 0.0,
+                'continuations': stats.continued,
+                'still_truncated': stats.still_truncated,
+            }
+        return report
+
+
+def _read_choice(result, on_usage=None):
+    choice = result['choices'][0]
+    content = choice['message'].get('content') or ''
+    usage = result.get('usage') or {}
+    if on_usage is not None:
+        on_usage(usage)
+    return content, completion_tokens(usage, content), choice.get('finish_reason')
+
+
+def completion_tokens(usage, content):
+    """Reported completion tokens, or a rough 4-characters-per-token estimate when the provider omits usage"""
+    return (usage or {}).get('completion_tokens') or max(1, len(content) // 4)
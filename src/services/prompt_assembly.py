@@ -0,0 +1,98 @@
+"""
+Prompt assembly for provider prompt caching
+Builds messages as a byte-stable system prefix (platform, persona and
+style instructions) followed by the variable user message, adds
+cache_control hints for providers that need them, and tallies the cached
+prefix tokens providers report.
+
+Providers only cache prefixes of roughly MIN_CACHEABLE_TOKENS or more;
+requests whose prefix is shorter are counted separately, so the metrics
+show how much of the traffic could be cached at all.
+"""
+
+import threading
+
+# Providers that only cache when the prompt marks a breakpoint; OpenAI,
+# DeepSeek and others cache long identical prefixes automatically
+CACHE_CONTROL_PREFIXES = ('anthropic/', 'google/gemini')
+
+# Smallest prefix OpenAI, Anthropic and Gemini will cache
+MIN_CACHEABLE_TOKENS = 1024
+
+
+def supports_cache_control(model):
+    return model.startswith(CACHE_CONTROL_PREFIXES)
+
+
+def stable_prefix(*parts):
+    """Join non-empty instruction parts in a fixed order with normalized whitespace"""
+    return '\n\n'.join(' '.join(part.split()) for part in parts if part and part.strip())
+
+
+def assemble_messages(model, prefix, user_message):
+    """[system prefix] + user message, with a cache breakpoint on the prefix when supported"""
+    messages = []
+    if prefix:
+        content = prefix
+        if supports_cache_control(model):
+            content = [{'type': 'text', 'text': prefix, 'cache_control': {'type': 'ephemeral'}}]
+        messages.append({'role': 'system', 'content': content})
+    messages.append({'role': 'user', 'content': user_message})
+    return messages
+
+
+def estimate_tokens(text):
+    """Rough 4-characters-per-token estimate"""
+    return len(text) // 4
+
+
+def prefix_tokens(messages):
+    """Estimated tokens in everything before the final (variable) message"""
+    total = 0
+    for message in messages[:-1]:
+        content = message['content']
+        if isinstance(content, list):
+            content = ''.join(part.get('text', '') for part in content)
+        total += estimate_tokens(content)
+    return total
+
+
+def cached_tokens(usage):
+    """Prefix tokens the provider served from its cache, across the usage shapes in the wild"""
+    if not usage:
+        return 0
+    details = usage.get('prompt_tokens_details') or {}
+    return int(details.get('cached_tokens') or usage.get('cache_read_input_tokens') or 0)
+
+
+class PromptCacheStats:
+    """Per-model counts of prompt tokens and how many were cache hits"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, usage, prefix_estimate=None):
+        if not usage:
+            return
+        cached = cached_tokens(usage)
+        with self._lock:
+            stats = self._models.setdefault(model, {
+                'requests': 0, 'cache_hits': 0, 'below_cache_minimum': 0, 'prompt_tokens': 0, 'cached_tokens': 0
+            })
+            stats['requests'] += 1
+            stats['cache_hits'] += bool(cached)
+            stats['below_cache_minimum'] += prefix_estimate is not None and prefix_estimate < MIN_CACHEABLE_TOKENS
+            stats['prompt_tokens'] += int(usage.get('prompt_tokens') or 0)
+            stats['cached_tokens'] += cached
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                model: {
+                    **stats,
+                    'cached_ratio': round(stats['cached_tokens'] / stats['prompt_tokens'], 4)
+                    if stats['prompt_tokens'] else 0.0
+                }
+                for model, stats in self._models.items()
+            }
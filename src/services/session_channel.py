@@ -0,0 +1,228 @@
+"""
+Session channels
+One long-lived, offset-addressed event stream per session that multiplexes
+both agents' token deltas, status changes, credit balances and diagnostics.
+Clients resume after a reconnect from the last offset they saw; producers
+block (briefly) when the slowest reader falls too far behind.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .json_codec import dumps
+
+
+class SessionChannel:
+    """Bounded, replayable event log for one session"""
+
+    def __init__(self, session_id, max_events=2000, max_lag=1500, producer_wait=5.0):
+        self.session_id = session_id
+        self.max_events = max_events
+        self.max_lag = max_lag
+        self.producer_wait = producer_wait
+        self.last_activity = time.monotonic()
+        self.unattended_since = time.monotonic()
+        self.backpressure_waits = 0
+        self._events = deque(maxlen=max_events)
+        self._next_offset = 0
+        self._readers = {}
+        self._reader_ids = itertools.count()
+        self._state = {}
+        self._cond = threading.Condition()
+
+    @property
+    def next_offset(self):
+        with self._cond:
+            return self._next_offset
+
+    def publish(self, event, data, block=True):
+        """Append an event and wake readers; returns its offset.
+
+        With block=True the producer waits up to producer_wait seconds while
+        any connected reader lags more than max_lag events behind.
+        """
+        with self._cond:
+            if block and self._readers:
+                deadline = time.monotonic() + self.producer_wait
+                while self._next_offset - min(self._readers.values()) > self.max_lag:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.backpressure_waits += 1
+                    self._cond.wait(remaining)
+            offset = self._next_offset
+            self._events.append((offset, event, data))
+            self._next_offset += 1
+            self._remember(event, data)
+            self.last_activity = time.monotonic()
+            self._cond.notify_all()
+            return offset
+
+    def _remember(self, event, data):
+        # Latest value per stream, sent as a snapshot to readers that fell out of the window
+        if event == 'token':
+            slot = self._state.setdefault(('text', data.get('slot')), [])
+            slot.append(data.get('delta', ''))
+        elif event == 'done':
+            self._state[('text', data.get('slot'))] = [data.get('content', '')]
+        elif event == 'status' and data.get('state') == 'working':
+            self._state[('text', data.get('slot'))] = []
+            self._state[('status', data.get('slot'))] = data
+        elif event in ('status', 'credits', 'diagnostics'):
+            key = (event, data.get('slot')) if event == 'status' else (event, None)
+            self._state[key] = data
+
+    def abandoned(self, grace):
+        """True once no reader has been connected for more than grace seconds"""
+        with self._cond:
+            return not self._readers and time.monotonic() - self.unattended_since > grace
+
+    def snapshot(self):
+        with self._cond:
+            return self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        state = {'text': {}, 'status': {}}
+        for (kind, slot), value in self._state.items():
+            if kind == 'text':
+                state['text'][slot] = ''.join(value)
+            elif kind == 'status':
+                state['status'][slot] = value
+            else:
+                state[kind] = value
+        return state
+
+    def subscribe(self, offset=None, heartbeat=15.0, stop=None):
+        """Yield (offset, event, data) from offset onwards; (None, None, None) on idle heartbeats.
+
+        If offset is older than the retained window, or ahead of the log (a
+        Last-Event-ID from before a restart), a 'reset' event carrying a
+        snapshot of the current state is yielded instead and the stream
+        continues with events published after it.
+        """
+        reader = next(self._reader_ids)
+        with self._cond:
+            cursor = self._next_offset if offset is None else max(0, offset)
+            oldest = self._events[0][0] if self._events else self._next_offset
+            if cursor < oldest or cursor > self._next_offset:
+                cursor = self._next_offset
+                reset = (cursor - 1, 'reset', {'resume_offset': cursor, 'state': self._snapshot_locked()})
+            else:
+                reset = None
+            self._readers[reader] = cursor
+            self.unattended_since = None
+        try:
+            if reset:
+                yield reset
+            while stop is None or not stop():
+                with self._cond:
+                    if cursor >= self._next_offset:
+                        self._cond.wait(heartbeat)
+                    oldest = self._events[0][0] if self._events else self._next_offset
+                    batch = [item for item in self._events if item[0] >= cursor] if cursor >= oldest else None
+                if batch is None:
+                    # Lost events while waiting; never silently skip
+                    with self._cond:
+                        cursor = self._next_offset
+                        state = self._snapshot_locked()
+                    yield cursor - 1, 'reset', {'resume_offset': cursor, 'state': state}
+                    continue
+                if not batch:
+                    yield None, None, None
+                    continue
+                for item in batch:
+                    yield item
+                cursor = batch[-1][0] + 1
+                with self._cond:
+                    self._readers[reader] = cursor
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._readers.pop(reader, None)
+                if not self._readers:
+                    self.unattended_since = time.monotonic()
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'session_id': self.session_id,
+                'next_offset': self._next_offset,
+                'retained_events': len(self._events),
+                'readers': len(self._readers),
+                'max_reader_lag': (self._next_offset - min(self._readers.values())) if self._readers else 0,
+                'backpressure_waits': self.backpressure_waits,
+            }
+
+
+class TokenBuffer:
+    """Coalesces token deltas into fewer, larger channel events"""
+
+    def __init__(self, channel, slot, agent_id, min_chars=48, max_delay=0.05):
+        self.channel = channel
+        self.slot = slot
+        self.agent_id = agent_id
+        self.min_chars = min_chars
+        self.max_delay = max_delay
+        self._parts = []
+        self._size = 0
+        self._since = time.monotonic()
+
+    def add(self, delta):
+        self._parts.append(delta)
+        self._size += len(delta)
+        if self._size >= self.min_chars or time.monotonic() - self._since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self.channel.publish('token', {'slot': self.slot, 'agent': self.agent_id, 'delta': ''.join(self._parts)})
+        self._parts = []
+        self._size = 0
+        self._since = time.monotonic()
+
+
+class ChannelRegistry:
+    """Channels by session id, dropping the least recently active beyond a limit or idle TTL"""
+
+    def __init__(self, max_channels=1000, idle_ttl=1800, **channel_options):
+        self.max_channels = max_channels
+        self.idle_ttl = idle_ttl
+        self.channel_options = channel_options
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, create=True):
+        with self._lock:
+            channel = self._channels.get(session_id)
+            if channel is None and create:
+                channel = self._channels[session_id] = SessionChannel(session_id, **self.channel_options)
+            if channel is not None:
+                self._channels.move_to_end(session_id)
+            self._prune(keep=session_id)
+            return channel
+
+    def _prune(self, keep=None):
+        now = time.monotonic()
+        for session_id in list(self._channels):
+            if session_id == keep:
+                continue
+            channel = self._channels[session_id]
+            idle = now - channel.last_activity > self.idle_ttl
+            if (idle or len(self._channels) > self.max_channels) and not channel.stats()['readers']:
+                del self._channels[session_id]
+            elif not idle and len(self._channels) <= self.max_channels:
+                break
+
+    def __len__(self):
+        with self._lock:
+            return len(self._channels)
+
+
+def format_sse(offset, event, data):
+    """Encode one event in text/event-stream framing"""
+    if event is None:
+        return b': keep-alive\n\n'
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (offset, event.encode('ascii'), dumps(data))
@@ -0,0 +1,215 @@
+"""
+Active session store
+Hot sessions live in memory as compact slotted records under an LRU and a
+memory budget; cold sessions spill to the SQLite sessions table and are
+rehydrated on next access. Sessions changed since their last write are
+flushed periodically and at interpreter exit, so a restart keeps them.
+"""
+
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Rough fixed cost of a record and its containers, on top of message text
+RECORD_OVERHEAD_BYTES = 512
+MESSAGE_OVERHEAD_BYTES = 120
+
+
+class SessionRecord:
+    """One active session; __slots__ keeps thousands of these cheap"""
+
+    __slots__ = ('id', 'user_id', 'mode', 'agents', 'personality', 'rounds',
+                 'status', 'messages', 'created_at', 'last_access', 'size')
+
+    def __init__(self, id, user_id=None, mode='manual', agents=(), personality=None,
+                 rounds=0, status='active', messages=None, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.mode = mode
+        self.agents = tuple(agents or ())
+        self.personality = personality
+        self.rounds = rounds
+        self.status = status
+        self.messages = messages or []
+        self.created_at = created_at or time.time()
+        self.last_access = time.time()
+        self.size = RECORD_OVERHEAD_BYTES + sum(_message_size(m) for m in self.messages)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'mode': self.mode,
+            'agents': list(self.agents),
+            'personality': self.personality,
+            'rounds': self.rounds,
+            'status': self.status,
+            'messages': self.messages,
+            'created_at': self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def _message_size(message):
+    return MESSAGE_OVERHEAD_BYTES + len(message.get('content') or '')
+
+
+class SessionStore:
+    """LRU of SessionRecords bounded by count and approximate bytes, spilling to SQLite"""
+
+    def __init__(self, db_path, max_sessions=5000, memory_budget=64 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.memory_budget = memory_budget
+        self._hot = OrderedDict()
+        self._dirty = set()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self.spills = 0
+        self.rehydrations = 0
+        self.flushes = 0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                conversation TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self._conn.commit()
+
+    def create(self, session_id, **fields):
+        """Register a new active session and return its record"""
+        record = SessionRecord(session_id, **fields)
+        with self._lock:
+            self._insert(record)
+            self._dirty.add(session_id)
+        return record
+
+    def get(self, session_id):
+        """Return the session record, rehydrating it from SQLite if it was spilled"""
+        with self._lock:
+            record = self._hot.get(session_id)
+            if record is not None:
+                self._hot.move_to_end(session_id)
+                record.last_access = time.time()
+                return record
+
+            row = self._conn.execute(
+                'SELECT conversation FROM sessions WHERE id = ?', (session_id,)
+            ).fetchone()
+            if row is None or not row[0]:
+                return None
+            record = SessionRecord.from_dict(json.loads(row[0]))
+            self.rehydrations += 1
+            self._insert(record)
+            return record
+
+    def append_message(self, session_id, role, content, **extra):
+        """Append a turn to a session; returns the record or None if unknown"""
+        with self._lock:
+            record = self.get(session_id)
+            if record is None:
+                return None
+            message = {'role': role, 'content': content, 'timestamp': time.time(), **extra}
+            record.messages.append(message)
+            size = _message_size(message)
+            record.size += size
+            self._bytes += size
+            self._dirty.add(session_id)
+            self._evict()
+            return record
+
+    def update(self, session_id, **fields):
+        with self._lock:
+            record = self.get(session_id)
+            if record is None:
+                return None
+            for key, value in fields.items():
+                setattr(record, key, value)
+            self._dirty.add(session_id)
+            return record
+
+    def flush(self):
+        """Write hot sessions changed since their last write to SQLite without evicting them"""
+        with self._lock:
+            if not self._dirty:
+                return
+            for session_id in list(self._dirty):
+                record = self._hot.get(session_id)
+                if record is not None:
+                    self._write(record)
+            self._conn.commit()
+            self.flushes += 1
+
+    def start_flushing(self, interval):
+        """Flush every interval seconds in the background (0 disables) and on interpreter exit"""
+        atexit.register(self.stop)
+        if self._flusher is None and interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, args=(interval,),
+                                             name='session-flush', daemon=True)
+            self._flusher.start()
+        return self
+
+    def _flush_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Still dirty, so the next pass retries
+                pass
+
+    def stop(self):
+        """Stop the background flusher and write whatever is still pending"""
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hot_sessions': len(self._hot),
+                'hot_bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'memory_budget': self.memory_budget,
+                'spills': self.spills,
+                'rehydrations': self.rehydrations,
+                'dirty_sessions': len(self._dirty),
+                'flushes': self.flushes,
+            }
+
+    def _insert(self, record):
+        previous = self._hot.pop(record.id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+        self._hot[record.id] = record
+        self._bytes += record.size
+        self._evict()
+
+    def _evict(self):
+        spilled = False
+        while len(self._hot) > 1 and (
+                len(self._hot) > self.max_sessions or self._bytes > self.memory_budget):
+            _, record = self._hot.popitem(last=False)
+            self._bytes -= record.size
+            self._write(record)
+            self.spills += 1
+            spilled = True
+        if spilled:
+            self._conn.commit()
+
+    def _write(self, record):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO sessions (id, user_id, conversation) VALUES (?, ?, ?)',
+            (record.id, record.user_id, json.dumps(record.to_dict()))
+        )
+        self._dirty.discard(record.id)
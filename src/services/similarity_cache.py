@@ -0,0 +1,189 @@
+"""
+Near-duplicate prompt cache
+SimHash fingerprints with a banded LSH index find candidate paraphrases
+(whitespace, casing, punctuation, filler words); a candidate is only served
+once its word unigrams and bigrams match the prompt's, so word order counts,
+and entries never cross scopes (one scope per user).
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+FINGERPRINT_BITS = 64
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Filler words that never change what a prompt asks for
+_FILLER_WORDS = frozenset(('a', 'an', 'the', 'please', 'kindly'))
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def normalized_tokens(text):
+    """Lower-cased alphanumeric tokens in order, without filler words"""
+    return tuple(token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in _FILLER_WORDS)
+
+
+def shingles(tokens):
+    """Unigrams plus ordered bigrams, so swapping two words changes the set"""
+    return frozenset(tokens) | frozenset(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+
+def simhash(text):
+    """64-bit SimHash over normalized word unigrams and bigrams (filler words dropped)"""
+    features = shingles(normalized_tokens(text))
+    if not features:
+        return 0
+
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        h = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def similarity(a, b):
+    """Fraction of matching fingerprint bits"""
+    return 1.0 - bin(a ^ b).count('1') / FINGERPRINT_BITS
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'shingles', 'value', 'size', 'stored_at')
+
+    def __init__(self, fingerprint, shingles, value, size, stored_at):
+        self.fingerprint = fingerprint
+        self.shingles = shingles
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+
+
+class SimilarityCache:
+    """LRU cache keyed by (scope, SimHash), looked up through an LSH band index.
+
+    SimHash distance only nominates candidates: a hit also needs a Jaccard of
+    at least min_jaccard over unigrams and bigrams, so changing or swapping
+    meaningful words (a language, an amount, "cats than dogs") is a miss
+    however close the fingerprints are.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=2048, max_bytes=8 * 1024 * 1024, ttl=3600,
+                 min_jaccard=1.0):
+        self.threshold = threshold
+        self.min_jaccard = min_jaccard
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # Any two fingerprints within max_distance bits agree on at least one
+        # of max_distance + 1 bands, so banding never misses a true match
+        self.max_distance = int((1.0 - threshold) * FINGERPRINT_BITS)
+        band_count = min(self.max_distance + 1, FINGERPRINT_BITS)
+        width = FINGERPRINT_BITS // band_count
+        self._bands = [
+            (i * width, FINGERPRINT_BITS if i == band_count - 1 else (i + 1) * width)
+            for i in range(band_count)
+        ]
+
+        self._entries = OrderedDict()
+        self._index = [dict() for _ in self._bands]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _band_keys(self, scope, fingerprint):
+        return [(scope, (fingerprint >> start) & ((1 << (end - start)) - 1)) for start, end in self._bands]
+
+    def get(self, text, scope=None):
+        """Return the cached value for the closest confirmed near-duplicate of text in scope, or None"""
+        fingerprint = simhash(text)
+        features = shingles(normalized_tokens(text))
+        now = time.time()
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for band, key in enumerate(self._band_keys(scope, fingerprint)):
+                for candidate in self._index[band].get(key, ()):
+                    distance = bin(candidate[1] ^ fingerprint).count('1')
+                    if distance < best_distance and jaccard(features, self._entries[candidate].shingles) >= self.min_jaccard:
+                        best, best_distance = candidate, distance
+
+            entry = self._entries.get(best) if best is not None else None
+            if entry and self.ttl and now - entry.stored_at > self.ttl:
+                self._remove(best)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return entry.value
+
+    def put(self, text, value, scope=None):
+        """Store value under the fingerprint of text within scope"""
+        key = (scope, simhash(text))
+        size = len(text) + len(str(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(key[1], shingles(normalized_tokens(text)), value, size, time.time())
+            self._bytes += size
+            for band, band_key in enumerate(self._band_keys(*key)):
+                self._index[band].setdefault(band_key, set()).add(key)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for band in self._index:
+                band.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for band, band_key in enumerate(self._band_keys(*key)):
+            bucket = self._index[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._index[band][band_key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'threshold': self.threshold,
+                'min_jaccard': self.min_jaccard,
+            }
@@ -0,0 +1,190 @@
+"""
+Shared state backends
+Counters, TTL keys and pub/sub behind one interface, so state that must
+agree across gunicorn workers and replicas can live in Redis while
+single-process deployments keep it in memory.
+"""
+
+import abc
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend(abc.ABC):
+    """Interface for shared state; values are strings"""
+
+    @abc.abstractmethod
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add amount to an integer key, starting its TTL if the key is new"""
+
+    @abc.abstractmethod
+    def get(self, key):
+        pass
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key):
+        pass
+
+    @abc.abstractmethod
+    def publish(self, channel, message):
+        pass
+
+    @abc.abstractmethod
+    def subscribe(self, channel, callback):
+        """Call callback(message) for every message published on channel"""
+
+    def close(self):
+        pass
+
+
+class InProcessBackend(StateBackend):
+    """Thread-safe in-memory backend for single-process deployments"""
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+            return True
+        return False
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            if self._expired(key) or key not in self._data:
+                self._data[key] = '0'
+                if ttl:
+                    self._expiry[key] = time.monotonic() + ttl
+            value = int(self._data[key]) + amount
+            self._data[key] = str(value)
+            return value
+
+    def get(self, key):
+        with self._lock:
+            if self._expired(key):
+                return None
+            return self._data.get(key)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = str(value)
+            if ttl:
+                self._expiry[key] = time.monotonic() + ttl
+            else:
+                self._expiry.pop(key, None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+
+    def publish(self, channel, message):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(message)
+        return len(callbacks)
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+
+class RedisBackend(StateBackend):
+    """Backend for anything speaking the Redis protocol (Redis, KeyDB, fakeredis)"""
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self._handlers = {}
+        self._listener = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    def incr(self, key, amount=1, ttl=None):
+        pipe = self.client.pipeline(transaction=True)
+        if ttl:
+            # Creates the key with its TTL only if it does not exist yet
+            pipe.set(key, 0, ex=int(ttl), nx=True)
+        pipe.incrby(key, amount)
+        return int(pipe.execute()[-1])
+
+    def get(self, key):
+        value = self.client.get(key)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, str(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def publish(self, channel, message):
+        return self.client.publish(channel, message)
+
+    def subscribe(self, channel, callback):
+        """Register callback; the listener thread connects (and reconnects) in the background"""
+        def handler(event):
+            data = event['data']
+            callback(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+        with self._lock:
+            self._handlers[channel] = handler
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='state-backend-pubsub', daemon=True)
+                self._listener.start()
+
+    def _listen(self, retry_delay=1.0, max_retry_delay=30.0):
+        import redis
+
+        delay = retry_delay
+        while not self._closed.is_set():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            subscribed = set()
+            try:
+                while not self._closed.is_set():
+                    with self._lock:
+                        pending = {channel: handler for channel, handler in self._handlers.items()
+                                   if channel not in subscribed}
+                    if pending:
+                        pubsub.subscribe(**pending)
+                        subscribed.update(pending)
+                        delay = retry_delay
+                    pubsub.get_message(timeout=0.5)
+            except redis.RedisError as e:
+                # An unreachable backend must not take the app down; messages are missed until it returns
+                logger.warning("State backend pub/sub unavailable, retrying in %ss: %s", delay, e)
+                self._closed.wait(delay)
+                delay = min(delay * 2, max_retry_delay)
+            finally:
+                pubsub.close()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.join(timeout=5)
+
+
+def create_state_backend(url=None):
+    """Redis backend for redis:// / rediss:// URLs, in-process otherwise"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    return InProcessBackend()
@@ -0,0 +1,183 @@
+"""
+Structured logging pipeline
+Request threads only sample and enqueue records; a background listener
+formats them as redacted JSON lines and writes them out. Access lines are
+emitted per request (with its id and route) so they are sampled like any
+other record; the development server's own access lines are dropped.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_route = contextvars.ContextVar('route', default=None)
+
+EMAIL_PATTERN = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}')
+SECRET_PATTERN = re.compile(
+    r'\b(?:sk|pk|rk|whsec)_(?:live|test)_[A-Za-z0-9]+'
+    r'|\bsk-or-[A-Za-z0-9-]+'
+    r'|\bcs_(?:live|test)_[A-Za-z0-9]+'
+    r'|Bearer\s+[A-Za-z0-9._~+/=-]+'
+)
+
+# Standard LogRecord attributes; anything else on a record came from `extra=`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+def get_request_id():
+    """Return the id of the request being handled on this thread, if any"""
+    return _request_id.get()
+
+
+def redact(text):
+    """Mask emails and API secrets in a log string"""
+    text = SECRET_PATTERN.sub('[REDACTED]', text)
+    return EMAIL_PATTERN.sub('[EMAIL]', text)
+
+
+def parse_sample_rates(spec):
+    """Parse "route=rate,route=rate" into a dict of floats"""
+    rates = {}
+    for item in (spec or '').split(','):
+        route, sep, rate = item.strip().partition('=')
+        if not sep:
+            continue
+        try:
+            rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class RouteSampler(logging.Filter):
+    """Keep a fraction of sub-WARNING records per route; warnings and errors always pass"""
+
+    def __init__(self, rates=None, default_rate=1.0):
+        super().__init__()
+        self.rates = rates or {}
+        self.default_rate = default_rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(_route.get(), self.default_rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DropServerAccessLines(logging.Filter):
+    """Drop werkzeug's access lines, which are written after the request context is gone"""
+
+    def filter(self, record):
+        return not (isinstance(record.msg, str) and record.msg.rstrip().endswith('"%s" %s %s'))
+
+
+class JSONFormatter(logging.Formatter):
+    """Render a record as one redacted JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+            'request_id': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = redact(value) if isinstance(value, str) else value
+        if record.exc_info:
+            entry['exception'] = redact(self.formatException(record.exc_info))
+        return json.dumps(entry, default=lambda value: redact(repr(value)))
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the listener and drops records when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Context variables are per-thread, so capture them before the hand-off
+        record.request_id = _request_id.get()
+        record.route = _route.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=logging.INFO, stream=None):
+    """Route all logging through a bounded queue drained by a background JSON writer"""
+    log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RouteSampler(
+        parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', '')),
+        float(os.getenv('LOG_SAMPLE_DEFAULT', 1.0)),
+    ))
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JSONFormatter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return handler, listener
+
+
+def init_request_logging(app):
+    """Assign every request an id (honouring an incoming X-Request-ID), echo it back and log an access line"""
+    access_logger = logging.getLogger('access')
+    logging.getLogger('werkzeug').addFilter(DropServerAccessLines())
+
+    @app.before_request
+    def _bind_request_context():
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        rule = request.url_rule.rule if request.url_rule else request.path
+        g.request_id = request_id
+        g._log_started = time.perf_counter()
+        g._log_tokens = (_request_id.set(request_id), _route.set(rule))
+
+    @app.after_request
+    def _echo_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+            # Logged while the route is still bound, so LOG_SAMPLE_RATES applies to it
+            access_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - g._log_started) * 1000, 2),
+            })
+        return response
+
+    @app.teardown_request
+    def _unbind_request_context(exc):
+        tokens = g.pop('_log_tokens', None)
+        if tokens:
+            _request_id.reset(tokens[0])
+            _route.reset(tokens[1])
@@ -0,0 +1,218 @@
+"""
+Traffic capture
+Opt-in middleware that records sanitized request envelopes, together with
+the upstream calls each request made and their timings, as gzip-compressed
+JSONL for later replay (see benchmarks/replay_capture.py).
+"""
+
+import atexit
+import gzip
+import hashlib
+import os
+import queue
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from flask import g, has_request_context, request
+
+from .json_codec import dumps, loads
+from .structured_logging import redact, REQUEST_ID_HEADER
+
+CAPTURED_HEADERS = ('Content-Type', 'Accept', 'X-User-ID')
+SENSITIVE_KEYS = {'email', 'customer_email', 'api_key', 'password', 'token', 'authorization'}
+# Identifiers kept consistent across a capture but never written in the clear
+PSEUDONYMIZED_PARAMS = {'user_id'}
+
+
+def sanitize(value):
+    """Recursively redact emails and secrets from a decoded JSON value"""
+    if isinstance(value, dict):
+        return {
+            key: '[REDACTED]' if key.lower() in SENSITIVE_KEYS else sanitize(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    if isinstance(value, str):
+        return redact(value)
+    return value
+
+
+def _pseudonymize(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:16]
+
+
+def sanitize_query(query):
+    """Redact a raw query string, pseudonymizing user ids like the X-User-ID header"""
+    if not query:
+        return query
+    params = []
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        if key.lower() in SENSITIVE_KEYS:
+            value = '[REDACTED]'
+        elif key.lower() in PSEUDONYMIZED_PARAMS:
+            value = _pseudonymize(value)
+        else:
+            value = redact(value)
+        params.append((key, value))
+    return urlencode(params)
+
+
+def _decode_body(raw):
+    if not raw:
+        return None
+    try:
+        return sanitize(loads(raw))
+    except ValueError:
+        return {'_unparsed_bytes': len(raw)}
+
+
+class TrafficCapture:
+    """Background writer appending capture envelopes to a .jsonl.gz file"""
+
+    def __init__(self, directory, sample_rate=1.0, max_queue=5000):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"capture-{os.getpid()}-{int(time.time())}.jsonl.gz")
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = gzip.open(self.path, 'ab')
+        self._thread = threading.Thread(target=self._drain, name='traffic-capture', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, envelope):
+        try:
+            self._queue.put_nowait(envelope)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        while True:
+            envelope = self._queue.get()
+            if envelope is None:
+                break
+            # Decoding and redaction happen here, off the request thread
+            if 'body' in envelope:
+                envelope['body'] = _decode_body(envelope['body'])
+            if envelope.get('query'):
+                envelope['query'] = sanitize_query(envelope['query'])
+            for call in envelope['upstream']:
+                if 'events' in call:
+                    call['events'] = sanitize(call['events'])
+                else:
+                    call['body'] = _decode_body(call['body'])
+            self._file.write(dumps(envelope) + b'\n')
+            self.written += 1
+            if self._queue.empty():
+                # Sync-flush so a capture stays readable while the process runs
+                self._file.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        if not self._file.closed:
+            self._file.close()
+
+
+def record_upstream_call(url, payload, response, elapsed, events=None):
+    """Attach an upstream call to the request currently being captured.
+
+    Streamed calls pass the decoded chunks as events instead of a body. Calls
+    still running after the response was sent (channel streams run in worker
+    threads) are written as separate 'upstream' records for the same request id.
+    """
+    call = {
+        'path': urlsplit(url).path,
+        'model': (payload or {}).get('model'),
+        'status': response.status_code,
+        'elapsed_ms': round(elapsed * 1000, 2),
+    }
+    if events is not None:
+        call['stream'] = True
+        call['events'] = events
+    else:
+        call['body'] = response.content
+    _attach(call)
+
+
+def record_external_call(url, status, elapsed, body):
+    """Attach a call to another upstream service (Stripe) made by the current request"""
+    _attach({
+        'path': urlsplit(url).path,
+        'model': None,
+        'status': status,
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'body': body,
+    })
+
+
+def _attach(call):
+    if not has_request_context():
+        return
+    late = g.get('_capture_late')
+    if late is not None:
+        capture, request_id = late
+        capture.submit({'kind': 'upstream', 'request_id': request_id, 'ts': time.time(), 'upstream': [call]})
+        return
+    calls = g.get('_capture_upstream')
+    if calls is not None:
+        calls.append(call)
+
+
+def init_traffic_capture(app, directory, sample_rate=1.0):
+    """Record requests to app into directory; returns the TrafficCapture"""
+    capture = TrafficCapture(directory, sample_rate)
+
+    @app.before_request
+    def _start_capture():
+        if request.method == 'OPTIONS' or random.random() >= capture.sample_rate:
+            return
+        g._capture_started = time.time()
+        g._capture_clock = time.perf_counter()
+        g._capture_upstream = []
+
+    @app.after_request
+    def _finish_capture(response):
+        started = g.pop('_capture_started', None)
+        if started is None:
+            return response
+        request_id = g.get('request_id') or request.headers.get(REQUEST_ID_HEADER)
+        # Upstream calls that finish after this point are submitted on their own
+        g._capture_late = (capture, request_id)
+        headers = {}
+        for name in CAPTURED_HEADERS:
+            value = request.headers.get(name)
+            if value is not None:
+                headers[name] = _pseudonymize(value) if name == 'X-User-ID' else value
+        capture.submit({
+            'request_id': request_id,
+            'ts': started,
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('latin-1'),
+            'headers': headers,
+            'body': request.get_data(cache=True),
+            'status': response.status_code,
+            'content_type': response.mimetype,
+            'duration_ms': round((time.perf_counter() - g.pop('_capture_clock')) * 1000, 2),
+            'upstream': g.pop('_capture_upstream', []),
+        })
+        return response
+
+    return capture
+
+
+def read_capture(path):
+    """Yield envelopes from a capture file, tolerating a truncated tail"""
+    with gzip.open(path, 'rb') as capture_file:
+        try:
+            for line in capture_file:
+                if line.strip():
+                    yield loads(line)
+        except (EOFError, OSError):
+            return
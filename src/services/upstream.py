@@ -0,0 +1,102 @@
+"""
+Upstream chat-completion calls
+Single place where the backend talks to OpenRouter-compatible APIs, so
+request ids, deadlines, timing and capture hooks apply to every call.
+"""
+
+import time
+
+import requests
+
+from .deadlines import DeadlineExceeded, check, record_cancellation, remaining, upstream_timeout
+from .json_codec import dumps, loads
+from .structured_logging import get_request_id, REQUEST_ID_HEADER
+from .traffic_capture import record_upstream_call
+
+
+class UpstreamError(Exception):
+    """Non-200 reply from the completion provider"""
+
+    def __init__(self, status_code, body=''):
+        super().__init__(f"Upstream returned {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+def _post(url, headers, body, timeout, stream=False):
+    try:
+        return requests.post(url, headers=headers, data=body, timeout=upstream_timeout(timeout), stream=stream)
+    except (DeadlineExceeded, requests.Timeout) as e:
+        left = remaining()
+        if isinstance(e, requests.Timeout) and (left is None or left > 0):
+            raise
+        record_cancellation('deadline_exceeded')
+        raise DeadlineExceeded() from e
+
+
+def post_chat_completion(base_url, headers, payload, timeout=None):
+    """POST payload to {base_url}/chat/completions and return the requests.Response.
+
+    timeout is further limited by the request deadline; DeadlineExceeded is
+    raised if the deadline has passed or runs out while waiting.
+    """
+    url = f"{base_url}/chat/completions"
+    headers = {**headers, 'Content-Type': 'application/json'}
+    request_id = get_request_id()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+
+    started = time.perf_counter()
+    response = _post(url, headers, dumps(payload), timeout)
+    record_upstream_call(url, payload, response, time.perf_counter() - started)
+    return response
+
+
+def stream_chat_completion(base_url, headers, payload, timeout=None, cancelled=None):
+    """Stream a completion, yielding {'delta', 'finish_reason', 'usage'} per upstream chunk.
+
+    Raises UpstreamError if the provider rejects the request and
+    DeadlineExceeded when the request deadline passes mid-stream. If
+    cancelled() becomes true the upstream connection is closed and the
+    generator simply stops.
+    """
+    url = f"{base_url}/chat/completions"
+    headers = {**headers, 'Content-Type': 'application/json', 'Accept': 'text/event-stream'}
+    request_id = get_request_id()
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+
+    started = time.perf_counter()
+    response = _post(url, headers, dumps({**payload, 'stream': True}), timeout, stream=True)
+    events = []
+
+    # Leaving this block closes the connection, which aborts generation upstream
+    with response:
+        if response.status_code != 200:
+            record_upstream_call(url, payload, response, time.perf_counter() - started)
+            raise UpstreamError(response.status_code, response.text[:500])
+        try:
+            for line in response.iter_lines():
+                if cancelled is not None and cancelled():
+                    record_cancellation('client_disconnect')
+                    return
+                try:
+                    check()
+                except DeadlineExceeded:
+                    record_cancellation('deadline_exceeded')
+                    raise
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[5:].strip()
+                if data == b'[DONE]':
+                    break
+                chunk = loads(data)
+                events.append(chunk)
+                choice = (chunk.get('choices') or [{}])[0]
+                yield {
+                    'delta': (choice.get('delta') or {}).get('content') or '',
+                    'finish_reason': choice.get('finish_reason'),
+                    'usage': chunk.get('usage'),
+                }
+        finally:
+            record_upstream_call(url, payload, response, time.perf_counter() - started, events=events)
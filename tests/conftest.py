@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Services are imported the way main.py imports them, with src/ on the path;
+# the repository root makes benchmarks/ importable too
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(1, ROOT)
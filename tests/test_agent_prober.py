@@ -0,0 +1,64 @@
+import pytest
+
+from services import agent_prober
+from services.agent_prober import AVAILABLE, AgentProber
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(agent_prober.time, 'time', lambda: now[0])
+    return now
+
+
+def test_cold_after_sits_between_regular_and_rested_gaps():
+    assert AgentProber(['m'], None, interval=300).cold_after == 450
+    assert AgentProber(['m'], None, interval=300, cold_after=900).cold_after == 900
+
+
+def test_regular_probes_are_not_cold_starts(clock):
+    prober = AgentProber(['m'], None, interval=300)
+    prober._record('m', True, 2500.0)
+    clock[0] += 300
+    prober._record('m', True, 400.0)
+    snapshot = prober.snapshot('m')
+    assert snapshot['cold_start_ms'] == 2500.0
+    assert snapshot['latency_ms'] == 400.0
+    assert snapshot['status'] == AVAILABLE
+
+
+def test_probe_after_a_rest_is_a_cold_start(clock):
+    prober = AgentProber(['m'], None, interval=300)
+    prober._record('m', True, 2500.0)
+    clock[0] += 300
+    prober._record('m', True, 400.0)
+    clock[0] += 600
+    prober._record('m', True, 1800.0)
+    assert prober.snapshot('m')['cold_start_ms'] == 1800.0
+
+
+def test_healthy_models_rest_in_turn(clock):
+    prober = AgentProber(['a', 'b'], None, interval=300)
+    # Unknown models are never rested
+    assert [prober.resting(r) for r in range(3)] == [None, None, None]
+    for model in ('a', 'b'):
+        prober._record(model, True, 100.0)
+    assert [prober.resting(r) for r in range(6)] == ['a', 'b', None, 'a', 'b', None]
+    prober._record('b', False, 100.0, 'timeout')
+    assert prober.resting(1) is None
+
+
+def test_run_skips_the_resting_model():
+    probed = []
+
+    def probe(model):
+        probed.append(model)
+        if len(probed) == 4:
+            prober.stop()
+        return True, 200
+
+    prober = AgentProber(['a', 'b'], probe, interval=0.01)
+    for model in ('a', 'b'):
+        prober._record(model, True, 100.0)
+    prober._run()
+    assert probed == ['b', 'a', 'a', 'b']
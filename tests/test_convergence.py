@@ -0,0 +1,54 @@
+from services.convergence import CONTINUE, STOP, SWITCH, ConvergenceDetector, novelty
+
+REPEAT = "the plan is to ship the feature next week after the review is done"
+
+
+def test_novelty_of_repeated_turn_is_zero():
+    assert novelty(REPEAT, [REPEAT]) == 0.0
+    assert novelty("an entirely different sentence about caching layers", [REPEAT]) == 1.0
+
+
+def test_replacement_speaks_before_stop():
+    detector = ConvergenceDetector(patience=2, min_turns=2, rotation=2)
+    decisions = [detector.observe(text)[1] for text in (
+        "first agent opens with a proposal about the launch",
+        "second agent replies with a question about pricing tiers",
+        REPEAT,
+    )]
+    assert decisions == [CONTINUE, CONTINUE, CONTINUE]
+    assert detector.observe(REPEAT)[1] == SWITCH
+    detector.switched()
+    # The other agent's turn: still low novelty, but the replacement has not spoken
+    assert detector.observe(REPEAT)[1] == CONTINUE
+    # The replacement's own turn decides
+    assert detector.observe(REPEAT)[1] == STOP
+    assert detector.switches == 1
+
+
+def test_fresh_replacement_keeps_going():
+    detector = ConvergenceDetector(patience=2, min_turns=0, rotation=2)
+    detector.observe(REPEAT)
+    assert detector.observe(REPEAT)[1] == SWITCH
+    detector.switched()
+    assert detector.observe(REPEAT)[1] == CONTINUE
+    assert detector.observe("a replacement brings brand new ideas about onboarding flows")[1] == CONTINUE
+
+
+def test_switch_without_replacement_stops_next_low_turn():
+    detector = ConvergenceDetector(patience=2, min_turns=0, rotation=2)
+    detector.observe(REPEAT)
+    assert detector.observe(REPEAT)[1] == SWITCH
+    assert detector.observe(REPEAT)[1] == STOP
+    assert detector.switches == 0
+
+
+def test_high_novelty_turn_counts_towards_the_hold():
+    detector = ConvergenceDetector(patience=2, min_turns=0, rotation=2)
+    detector.observe(REPEAT)
+    assert detector.observe(REPEAT)[1] == SWITCH
+    detector.switched()
+    # The other agent says something new, then the replacement repeats itself
+    assert detector.observe("the other agent raises a fresh point about supplier contracts")[1] == CONTINUE
+    assert detector.observe(REPEAT)[1] == SWITCH
+    detector.switched()
+    assert detector.switches == 2
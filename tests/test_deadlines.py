@@ -0,0 +1,107 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+from flask import Flask, jsonify
+
+from benchmarks.replay_capture import RecordedUpstream, make_handler
+from services import deadlines
+from services.deadlines import DEADLINE_HEADER, DeadlineExceeded, cancellation_stats, init_deadlines
+from services.session_channel import SessionChannel
+from services.upstream import post_chat_completion, stream_chat_completion
+
+
+def make_app(default_seconds, endpoints=None, fallback_seconds=30):
+    app = Flask(__name__)
+    init_deadlines(app, default_seconds, endpoints=endpoints, fallback_seconds=fallback_seconds)
+
+    @app.route('/work', methods=['GET', 'OPTIONS'])
+    def work():
+        return jsonify({'remaining': deadlines.remaining()})
+
+    @app.route('/other')
+    def other():
+        return jsonify({'remaining': deadlines.remaining()})
+
+    return app.test_client()
+
+
+def test_plan_ceiling_applies_without_header():
+    remaining = make_app(lambda: 20).get('/work').get_json()['remaining']
+    assert 19 < remaining <= 20
+
+
+def test_header_can_only_shorten_the_deadline():
+    client = make_app(lambda: 20)
+    assert client.get('/work', headers={DEADLINE_HEADER: '5000'}).get_json()['remaining'] <= 5
+    assert client.get('/work', headers={DEADLINE_HEADER: '600000'}).get_json()['remaining'] <= 20
+    # Unparseable headers fall back to the plan ceiling
+    assert client.get('/work', headers={DEADLINE_HEADER: 'soon'}).get_json()['remaining'] > 19
+
+
+def test_plan_lookup_failure_falls_back():
+    def broken():
+        raise ConnectionError('plan store down')
+
+    remaining = make_app(broken, fallback_seconds=7).get('/work').get_json()['remaining']
+    assert 6 < remaining <= 7
+
+
+def test_only_listed_endpoints_get_a_deadline():
+    lookups = []
+    client = make_app(lambda: lookups.append(1) or 20, endpoints={'work'})
+    assert client.get('/other').get_json()['remaining'] is None
+    assert client.open('/work', method='OPTIONS').status_code == 200
+    assert lookups == []
+    assert client.get('/work').get_json()['remaining'] is not None
+    # The deadline does not leak out of the request
+    assert deadlines.remaining() is None
+
+
+def test_expired_deadline_cancels_before_calling_upstream():
+    app = Flask(__name__)
+    init_deadlines(app, lambda: 20)
+    before = cancellation_stats()['deadline_exceeded']
+    with app.test_request_context('/', headers={DEADLINE_HEADER: '0'}):
+        app.preprocess_request()
+        with pytest.raises(DeadlineExceeded):
+            post_chat_completion('http://127.0.0.1:1', {}, {'model': 'm', 'messages': []})
+    assert cancellation_stats()['deadline_exceeded'] == before + 1
+
+
+def test_chat_returns_504_when_deadline_runs_out():
+    main = pytest.importorskip('main')
+    before = cancellation_stats()['deadline_exceeded']
+    response = main.app.test_client().post('/api/chat', json={'agent': 'gpt4o', 'message': 'hello'},
+                                           headers={DEADLINE_HEADER: '0'})
+    assert response.status_code == 504
+    assert response.get_json() == {'error': 'Request deadline exceeded'}
+    assert cancellation_stats()['deadline_exceeded'] == before + 1
+
+
+@pytest.fixture
+def slow_stream():
+    events = [{'choices': [{'delta': {'content': f'token{i} '}, 'finish_reason': None}]} for i in range(20)]
+    upstream = RecordedUpstream([{'request_id': 'req-1', 'upstream': [{
+        'path': '/chat/completions', 'model': 'm', 'status': 200, 'elapsed_ms': 2000,
+        'stream': True, 'events': events,
+    }]}])
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(upstream))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_abandoned_channel_counts_client_disconnect(slow_stream):
+    channel = SessionChannel('s1')
+    before = cancellation_stats()['client_disconnect']
+    deltas = []
+    started = time.monotonic()
+    stream = stream_chat_completion(slow_stream, {'X-Request-ID': 'req-1'}, {'model': 'm', 'messages': []},
+                                    timeout=5, cancelled=lambda: len(deltas) >= 2 and channel.abandoned(0))
+    for chunk in stream:
+        deltas.append(chunk['delta'])
+    assert deltas == ['token0 ', 'token1 ']
+    assert time.monotonic() - started < 1.5
+    assert cancellation_stats()['client_disconnect'] == before + 1
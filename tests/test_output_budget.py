@@ -0,0 +1,90 @@
+import pytest
+
+from services.deadlines import DeadlineExceeded
+from services.json_codec import dumps
+from services.output_budget import CONTINUE_PROMPT, OTHER_MODE, OutputBudgetController, parse_modes
+
+
+def test_unknown_modes_share_one_bucket():
+    controller = OutputBudgetController(modes={'general'})
+    for i in range(50):
+        controller.observe('gpt4o', f'mode-{i}', 100)
+    controller.observe('gpt4o', 'general', 200)
+    stats = controller.stats()['gpt4o']
+    assert set(stats) == {'general', OTHER_MODE}
+    assert stats[OTHER_MODE]['requests'] == 50
+
+
+def test_budget_reads_the_pooled_bucket():
+    controller = OutputBudgetController(modes={'general'}, min_samples=5)
+    for _ in range(5):
+        controller.observe('gpt4o', 'made-up', 300)
+    assert controller.budget('gpt4o', 'another-made-up', 4096) == controller.budget('gpt4o', OTHER_MODE, 4096) < 4096
+    assert controller.budget('gpt4o', 'general', 4096) == 4096
+
+
+def test_parse_modes():
+    assert parse_modes(' debate, general ,,') == {'debate', 'general'}
+    assert 'manual' in parse_modes('')
+
+
+def scripted(*results):
+    """attempt() returning results in order; exceptions are raised"""
+    calls = []
+
+    def attempt(payload):
+        calls.append(payload)
+        result = results[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return attempt, calls
+
+
+def test_run_continues_truncated_replies():
+    controller = OutputBudgetController(max_continuations=2)
+    attempt, calls = scripted(('one ', 10, 'length'), ('two ', 10, 'length'), ('three', 5, 'stop'))
+    payload = {'model': 'm', 'messages': [{'role': 'user', 'content': 'go'}]}
+    assert controller.run('gpt4o', 'general', 4096, payload, attempt) == ('one two three', 'stop')
+    assert calls[1]['messages'][-2:] == [{'role': 'assistant', 'content': 'one '},
+                                          {'role': 'user', 'content': CONTINUE_PROMPT}]
+    assert calls[2]['max_tokens'] == 4096
+    stats = controller.stats()['gpt4o']['general']
+    assert (stats['truncated'], stats['continuations'], stats['still_truncated']) == (1, 2, 0)
+    assert stats['max_tokens_observed'] == 25
+
+
+@pytest.mark.parametrize('failure', [None, DeadlineExceeded()])
+def test_failed_continuation_keeps_partial_reply(failure):
+    controller = OutputBudgetController()
+    attempt, _ = scripted(('partial', 10, 'length'), failure)
+    assert controller.run('gpt4o', 'general', 4096, {'messages': []}, attempt) == ('partial', 'length')
+    assert controller.stats()['gpt4o']['general']['still_truncated'] == 1
+
+
+def test_failed_first_call_is_not_observed():
+    controller = OutputBudgetController()
+    attempt, _ = scripted(None)
+    assert controller.run('gpt4o', 'general', 4096, {'messages': []}, attempt) is None
+    assert controller.stats() == {}
+    attempt, _ = scripted(DeadlineExceeded())
+    with pytest.raises(DeadlineExceeded):
+        controller.run('gpt4o', 'general', 4096, {'messages': []}, attempt)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content='', finish_reason='stop'):
+        self.status_code = status_code
+        self.content = dumps({'choices': [{'message': {'content': content}, 'finish_reason': finish_reason}],
+                              'usage': {'completion_tokens': 7}})
+
+
+def test_complete_returns_last_good_response():
+    controller = OutputBudgetController()
+    first, rejected = FakeResponse(200, 'half', 'length'), FakeResponse(500)
+    responses = iter([first, rejected])
+    response, content = controller.complete('gpt4o', 'general', 4096, lambda body: next(responses), {'messages': []})
+    assert response is first and content == 'half'
+    response, content = controller.complete('gpt4o', 'general', 4096, lambda body: rejected, {'messages': []})
+    assert response is rejected and content is None
@@ -0,0 +1,99 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.replay_capture import RecordedUpstream, make_handler
+from services.json_codec import dumps
+from services.output_budget import OutputBudgetController
+from services.prompt_assembly import (
+    MIN_CACHEABLE_TOKENS, PromptCacheStats, assemble_messages, cached_tokens, prefix_tokens, stable_prefix,
+)
+from services.upstream import post_chat_completion
+
+PREFIX = stable_prefix("You are a  helpful\nassistant.", "Let's analyze this systematically.")
+
+
+def _has_cache_control(messages):
+    return b'cache_control' in dumps(messages)
+
+
+def test_stable_prefix_normalizes_whitespace():
+    assert PREFIX == stable_prefix("You are a helpful assistant.", "  Let's analyze this systematically. ")
+
+
+@pytest.mark.parametrize('model', ['openai/gpt-4o', 'meta-llama/llama-3.3-70b-instruct', 'deepseek/deepseek-r1'])
+def test_no_cache_control_for_automatic_caching_providers(model):
+    messages = assemble_messages(model, PREFIX, 'next question')
+    assert not _has_cache_control(messages)
+    assert messages == [{'role': 'system', 'content': PREFIX}, {'role': 'user', 'content': 'next question'}]
+
+
+@pytest.mark.parametrize('model', ['anthropic/claude-3.5-sonnet', 'google/gemini-pro-1.5'])
+def test_cache_control_on_system_prefix_for_supported_models(model):
+    messages = assemble_messages(model, PREFIX, 'next question')
+    assert messages[0]['content'] == [{'type': 'text', 'text': PREFIX, 'cache_control': {'type': 'ephemeral'}}]
+    assert messages[-1] == {'role': 'user', 'content': 'next question'}
+
+
+def test_prefix_bytes_are_stable_across_turns():
+    model = 'anthropic/claude-3.5-sonnet'
+    first = assemble_messages(model, PREFIX, 'next question')
+    later = assemble_messages(model, stable_prefix("You are a helpful assistant.", "Let's analyze this systematically."), 'and then?')
+    assert dumps(first[:-1]) == dumps(later[:-1])
+    assert assemble_messages(model, '', 'hi') == [{'role': 'user', 'content': 'hi'}]
+
+
+def test_cached_tokens_across_usage_shapes():
+    assert cached_tokens({'prompt_tokens_details': {'cached_tokens': 1200}}) == 1200
+    assert cached_tokens({'cache_read_input_tokens': 900}) == 900
+    assert cached_tokens({'prompt_tokens': 10}) == 0
+    assert cached_tokens(None) == 0
+
+
+@pytest.fixture
+def mock_upstream():
+    def completion(cached):
+        return {
+            'path': '/chat/completions', 'model': 'anthropic/claude-3.5-sonnet', 'status': 200, 'elapsed_ms': 0,
+            'body': {
+                'choices': [{'message': {'role': 'assistant', 'content': 'ok'}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 2000, 'completion_tokens': 1,
+                          'prompt_tokens_details': {'cached_tokens': cached}},
+            },
+        }
+
+    upstream = RecordedUpstream([{'request_id': 'req-1', 'upstream': [completion(0), completion(1536)]}])
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(upstream))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_cache_hits_recorded_from_mock_upstream(mock_upstream):
+    model = 'anthropic/claude-3.5-sonnet'
+    messages = assemble_messages(model, stable_prefix(PREFIX, 'Reference material: ' + 'word ' * 1000), 'next question')
+    assert prefix_tokens(messages) >= MIN_CACHEABLE_TOKENS
+
+    stats = PromptCacheStats()
+    budgets = OutputBudgetController()
+    send = lambda body: post_chat_completion(mock_upstream, {'X-Request-ID': 'req-1'}, body, timeout=5)
+    for _ in range(2):
+        response, content = budgets.complete(
+            'claude', 'general', 1000, send, {'model': model, 'messages': messages},
+            on_usage=lambda usage: stats.record(model, usage, prefix_tokens(messages))
+        )
+        assert response.status_code == 200 and content == 'ok'
+
+    snapshot = stats.snapshot()[model]
+    assert snapshot['requests'] == 2
+    assert snapshot['cache_hits'] == 1
+    assert snapshot['cached_tokens'] == 1536
+    assert snapshot['below_cache_minimum'] == 0
+    assert snapshot['cached_ratio'] == round(1536 / 4000, 4)
+
+
+def test_short_prefixes_are_counted():
+    stats = PromptCacheStats()
+    stats.record('openai/gpt-4o', {'prompt_tokens': 40}, prefix_tokens(assemble_messages('openai/gpt-4o', PREFIX, 'hi')))
+    assert stats.snapshot()['openai/gpt-4o']['below_cache_minimum'] == 1
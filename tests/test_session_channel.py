@@ -0,0 +1,130 @@
+import threading
+
+from services.session_channel import ChannelRegistry, SessionChannel, TokenBuffer, format_sse
+
+
+def take(channel, offset, count, heartbeat=0.05):
+    """First count items a reader sees from offset (heartbeats included)"""
+    items = []
+    for item in channel.subscribe(offset, heartbeat=heartbeat):
+        items.append(item)
+        if len(items) == count:
+            break
+    return items
+
+
+def populated(events=6):
+    channel = SessionChannel('s1')
+    channel.publish('status', {'slot': 'a', 'state': 'working'})
+    for i in range(events - 2):
+        channel.publish('token', {'slot': 'a', 'delta': f'w{i} '})
+    channel.publish('done', {'slot': 'a', 'content': 'w0 w1 w2 w3 '})
+    return channel
+
+
+def test_replays_from_offset():
+    channel = populated()
+    items = take(channel, 4, 2)
+    assert [(offset, event) for offset, event, _ in items] == [(4, 'token'), (5, 'done')]
+
+
+def test_offset_ahead_of_log_gets_reset_snapshot():
+    channel = populated()
+    offset, event, data = take(channel, 100, 1)[0]
+    assert event == 'reset'
+    assert data['resume_offset'] == 6
+    assert data['state']['text']['a'] == 'w0 w1 w2 w3 '
+    assert channel.stats()['max_reader_lag'] == 0
+
+
+def test_offset_ahead_then_follows_new_events():
+    channel = populated()
+    reader = channel.subscribe(100, heartbeat=0.05)
+    assert next(reader)[1] == 'reset'
+    channel.publish('status', {'slot': 'b', 'state': 'working'})
+    assert next(reader)[:2] == (6, 'status')
+    assert channel.stats()['max_reader_lag'] >= 0
+    reader.close()
+
+
+def test_stale_offset_gets_reset_snapshot():
+    channel = SessionChannel('s1', max_events=3)
+    for i in range(5):
+        channel.publish('token', {'slot': 'a', 'delta': str(i)})
+    offset, event, data = take(channel, 0, 1)[0]
+    assert event == 'reset'
+    assert data == {'resume_offset': 5, 'state': {'text': {'a': '01234'}, 'status': {}}}
+
+
+def test_idle_reader_gets_heartbeats():
+    channel = populated()
+    assert take(channel, None, 1) == [(None, None, None)]
+
+
+def test_readers_are_tracked_for_abandonment():
+    channel = SessionChannel('s1')
+    assert not channel.abandoned(grace=60)
+    reader = channel.subscribe(0, heartbeat=0.01)
+    next(reader)
+    assert channel.stats()['readers'] == 1
+    reader.close()
+    assert channel.stats()['readers'] == 0
+    assert channel.abandoned(grace=0)
+
+
+def test_slow_reader_applies_backpressure():
+    channel = SessionChannel('s1', max_lag=2, producer_wait=0.05)
+    reader = channel.subscribe(0, heartbeat=0.01)
+    next(reader)
+    for i in range(4):
+        channel.publish('token', {'slot': 'a', 'delta': str(i)})
+    assert channel.backpressure_waits > 0
+    # Non-blocking publishes never wait
+    waits = channel.backpressure_waits
+    channel.publish('credits', {'credits': 1}, block=False)
+    assert channel.backpressure_waits == waits
+    reader.close()
+
+
+def test_token_buffer_coalesces_deltas():
+    channel = SessionChannel('s1')
+    buffer = TokenBuffer(channel, 'a', 'gpt4o', min_chars=10, max_delay=60)
+    for delta in ('ab', 'cd', 'ef'):
+        buffer.add(delta)
+    assert channel.next_offset == 0
+    buffer.flush()
+    assert channel.snapshot()['text']['a'] == 'abcdef'
+    assert channel.next_offset == 1
+
+
+def test_registry_drops_least_recent_channels_without_readers():
+    registry = ChannelRegistry(max_channels=2)
+    for session_id in ('a', 'b', 'c'):
+        registry.get(session_id)
+    assert len(registry) == 2
+    assert registry.get('a', create=False) is None
+
+
+def test_concurrent_reader_sees_every_event():
+    channel = SessionChannel('s1')
+    seen = []
+
+    def read():
+        for offset, event, _ in channel.subscribe(0, heartbeat=0.05):
+            if event == 'done':
+                break
+            if event is not None:
+                seen.append(offset)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    for i in range(50):
+        channel.publish('token', {'slot': 'a', 'delta': str(i)})
+    channel.publish('done', {'slot': 'a', 'content': ''})
+    thread.join(5)
+    assert seen == list(range(50))
+
+
+def test_format_sse():
+    assert format_sse(None, None, None) == b': keep-alive\n\n'
+    assert format_sse(3, 'done', {'slot': 'a'}) == b'id: 3\nevent: done\ndata: {"slot":"a"}\n\n'
@@ -0,0 +1,42 @@
+import time
+
+from services.session_store import SessionStore
+
+
+def test_flush_persists_hot_sessions_across_restart(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    store = SessionStore(path)
+    store.create('s1', user_id='u1')
+    store.append_message('s1', 'user', 'hello')
+    assert store.stats()['dirty_sessions'] == 1
+    store.stop()
+    assert store.stats()['dirty_sessions'] == 0
+
+    restarted = SessionStore(path)
+    record = restarted.get('s1')
+    assert record.user_id == 'u1'
+    assert [m['content'] for m in record.messages] == ['hello']
+
+
+def test_flush_writes_only_changed_sessions(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.db'))
+    store.create('s1')
+    store.flush()
+    flushes = store.stats()['flushes']
+    store.flush()
+    assert store.stats()['flushes'] == flushes
+    store.update('s1', status='completed')
+    store.flush()
+    assert store.stats()['flushes'] == flushes + 1
+
+
+def test_background_flusher(tmp_path):
+    store = SessionStore(str(tmp_path / 'sessions.db')).start_flushing(0.05)
+    try:
+        store.create('s1')
+        deadline = time.monotonic() + 2
+        while store.stats()['dirty_sessions'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert store.stats()['dirty_sessions'] == 0
+    finally:
+        store.stop()
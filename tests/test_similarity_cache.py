@@ -0,0 +1,94 @@
+import pytest
+
+from services.similarity_cache import SimilarityCache, normalized_tokens, similarity, simhash
+
+HITS = [
+    ("What is the capital of France?", "what is the capital of france"),
+    ("Explain recursion with an example.", "Please explain recursion with an example"),
+    ("Summarize this article in three bullet points", "Summarize this article, in three bullet points!"),
+    ("How do I reverse a list in Python", "how do i reverse a list in   python ?"),
+]
+
+MISSES = [
+    ("Write a detailed step by step tutorial on how to build a REST API with authentication "
+     "and rate limiting in Python for beginners",
+     "Write a detailed step by step tutorial on how to build a REST API with authentication "
+     "and rate limiting in Java for beginners"),
+    ("Please summarize the following quarterly report for the board meeting focusing on revenue "
+     "growth customer churn and hiring plans",
+     "Please critique the following quarterly report for the board meeting focusing on revenue "
+     "growth customer churn and hiring plans"),
+    ("Create a monthly household budget plan for a family of four with $300 for groceries "
+     "including savings goals and an emergency fund",
+     "Create a monthly household budget plan for a family of four with $3000 for groceries "
+     "including savings goals and an emergency fund"),
+    ("Is it safe to mix bleach and vinegar", "Is it not safe to mix bleach and vinegar"),
+    ("Write a short essay explaining why cats are better than dogs as pets for people living in "
+     "small apartments",
+     "Write a short essay explaining why dogs are better than cats as pets for people living in "
+     "small apartments"),
+]
+
+
+@pytest.mark.parametrize('stored, query', HITS)
+def test_paraphrases_hit(stored, query):
+    cache = SimilarityCache(threshold=0.9)
+    cache.put(stored, 'answer', scope='u1')
+    assert cache.get(query, scope='u1') == 'answer'
+
+
+@pytest.mark.parametrize('stored, query', MISSES)
+def test_one_word_changes_miss(stored, query):
+    cache = SimilarityCache(threshold=0.9)
+    cache.put(stored, 'answer', scope='u1')
+    assert cache.get(query, scope='u1') is None
+
+
+def test_token_check_rejects_close_fingerprints():
+    stored, query = MISSES[0]
+    assert similarity(simhash(stored), simhash(query)) >= 0.85
+    unchecked = SimilarityCache(threshold=0.85, min_jaccard=0.0)
+    checked = SimilarityCache(threshold=0.85)
+    for cache in (unchecked, checked):
+        cache.put(stored, 'python answer', scope='u1')
+    assert unchecked.get(query, scope='u1') == 'python answer'
+    assert checked.get(query, scope='u1') is None
+
+
+def test_word_order_counts():
+    stored, query = MISSES[-1]
+    unchecked = SimilarityCache(threshold=0.8, min_jaccard=0.0)
+    checked = SimilarityCache(threshold=0.8)
+    for cache in (unchecked, checked):
+        cache.put(stored, 'cats win', scope='u1')
+    assert unchecked.get(query, scope='u1') == 'cats win'
+    assert checked.get(query, scope='u1') is None
+
+
+def test_scopes_are_isolated():
+    cache = SimilarityCache(threshold=0.9)
+    cache.put("Draft an email to my landlord about the leak", 'for u1', scope='u1')
+    assert cache.get("Draft an email to my landlord about the leak", scope='u2') is None
+    assert cache.get("Draft an email to my landlord about the leak", scope='u1') == 'for u1'
+    assert cache.stats()['hits'] == 1
+
+
+def test_lower_min_jaccard_accepts_small_differences():
+    cache = SimilarityCache(threshold=0.9, min_jaccard=0.5)
+    cache.put("Give me a short history of the city of Paris from the Romans to the Revolution", 'history')
+    assert cache.get("Give me a short history of the city of Paris from the Romans to the French Revolution") == 'history'
+
+
+def test_normalized_tokens_drop_filler_words():
+    assert normalized_tokens("Please explain THE plan") == normalized_tokens("explain plan")
+
+
+def test_evicts_by_entries_and_clears():
+    cache = SimilarityCache(max_entries=2)
+    for i in range(3):
+        cache.put(f"question number {i}", i, scope='u1')
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['evictions'] == 1
+    assert cache.get("question number 0", scope='u1') is None
+    cache.clear()
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from services import state_backend
+from services.state_backend import InProcessBackend, RedisBackend, StateBackend
+
+
+@pytest.fixture(params=['inprocess', 'redis'])
+def backend(request):
+    if request.param == 'inprocess':
+        instance = InProcessBackend()
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        instance = RedisBackend(client=fakeredis.FakeRedis(decode_responses=True))
+    yield instance
+    instance.close()
+
+
+def expire(backend, monkeypatch, key, seconds):
+    """Move past a key's TTL without sleeping"""
+    if isinstance(backend, RedisBackend):
+        assert 0 < backend.client.ttl(key) <= seconds
+        backend.client.expire(key, 1)
+        time.sleep(1.1)
+    else:
+        now = time.monotonic()
+        monkeypatch.setattr(state_backend.time, 'monotonic', lambda: now + seconds + 1)
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_incr_counts_and_expires(backend, monkeypatch):
+    assert backend.incr('daily', 3, ttl=60) == 3
+    assert backend.incr('daily', 2, ttl=60) == 5
+    assert backend.get('daily') == '5'
+    expire(backend, monkeypatch, 'daily', 60)
+    assert backend.get('daily') is None
+    assert backend.incr('daily', 1, ttl=60) == 1
+
+
+def test_incr_without_ttl_persists(backend):
+    assert backend.incr('used') == 1
+    assert backend.incr('used', -1) == 0
+    if isinstance(backend, RedisBackend):
+        assert backend.client.ttl('used') == -1
+
+
+def test_set_get_delete(backend, monkeypatch):
+    assert backend.get('plan') is None
+    backend.set('plan', 'expert')
+    assert backend.get('plan') == 'expert'
+    backend.set('token', 42, ttl=30)
+    assert backend.get('token') == '42'
+    backend.delete('plan')
+    assert backend.get('plan') is None
+    expire(backend, monkeypatch, 'token', 30)
+    assert backend.get('token') is None
+
+
+def test_publish_reaches_subscribers(backend):
+    received = []
+    delivered = threading.Event()
+
+    def on_message(message):
+        received.append(message)
+        delivered.set()
+
+    backend.subscribe('invalidate', on_message)
+    # Redis delivers from a listener thread; give the subscription time to register
+    deadline = time.monotonic() + 5
+    while not delivered.is_set() and time.monotonic() < deadline:
+        backend.publish('invalidate', 'gpt4o')
+        delivered.wait(0.2)
+    assert received and received[0] == 'gpt4o'
+    backend.publish('other', 'ignored')
+    time.sleep(0.1)
+    assert 'ignored' not in received
+
+
+def test_unreachable_redis_does_not_fail_subscribe():
+    redis = pytest.importorskip('redis')
+    backend = RedisBackend(client=redis.Redis(host='127.0.0.1', port=1, socket_connect_timeout=0.1))
+    backend.subscribe('invalidate', lambda message: None)
+    time.sleep(0.2)
+    assert backend._listener.is_alive()
+    backend.close()
+    assert backend._listener is None
@@ -0,0 +1,32 @@
+from urllib.parse import parse_qs
+
+from services.traffic_capture import TrafficCapture, read_capture, sanitize, sanitize_query
+
+
+def test_query_user_id_is_pseudonymized_like_the_header():
+    query = parse_qs(sanitize_query('user_id=alice%40example.com&offset=3&token=sk_live_abc'))
+    assert query['offset'] == ['3']
+    assert query['token'] == ['[REDACTED]']
+    assert 'alice' not in query['user_id'][0] and len(query['user_id'][0]) == 16
+    assert sanitize_query('user_id=alice') == sanitize_query('user_id=alice')
+    assert sanitize_query('') == ''
+
+
+def test_free_text_query_values_are_redacted():
+    assert parse_qs(sanitize_query('q=mail+bob%40example.com'))['q'] == ['mail [EMAIL]']
+
+
+def test_sanitize_body():
+    assert sanitize({'email': 'a@b.co', 'messages': ['key sk-or-v1-abc']}) == {
+        'email': '[REDACTED]', 'messages': ['key [REDACTED]']
+    }
+
+
+def test_capture_file_round_trip(tmp_path):
+    capture = TrafficCapture(str(tmp_path))
+    capture.submit({'request_id': 'r1', 'ts': 1.0, 'query': 'user_id=alice', 'body': b'{"email": "x@y.io"}',
+                    'upstream': []})
+    capture.close()
+    [envelope] = list(read_capture(capture.path))
+    assert envelope['body'] == {'email': '[REDACTED]'}
+    assert 'alice' not in envelope['query']